@@ -0,0 +1,355 @@
+"""
+Offline benchmark of the voice recognition middleware.
+
+Speech APIs are replaced by the local stubs in :mod:`stubs`, and
+synthetic voice messages of different lengths are fed to
+``VoiceRecogMiddleware.process_message`` at different concurrency
+levels. For each run, throughput, p50/p99 latency (from
+``process_message`` to the final edit), peak RSS and peak thread count
+are reported.
+
+Usage::
+
+    python benchmarks/benchmark.py --durations 2 10 30 --concurrency 1 8
+
+Azure needs ffmpeg to encode Ogg/Opus, and is skipped if it is not
+installed. The exit status is non-zero if any message fails, so the
+benchmark can run in CI.
+"""
+import argparse
+import atexit
+import io
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import wave
+from typing import Any, Dict, List, Optional, Set
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from ehforwarderbot import coordinator, Message, MsgType  # noqa: E402
+from ehforwarderbot.channel import MasterChannel  # noqa: E402
+from ehforwarderbot.chat import PrivateChat  # noqa: E402
+
+from stubs import FakeAsrClient, HTTPStub, IFlyTekStub  # noqa: E402
+
+ENGINES = ("baidu", "azure", "iflytek", "tencent")
+SAMPLE_RATE = 16000
+
+
+class _MasterChannel(MasterChannel):
+    """Stand-in of the master channel, messages are delivered to it."""
+    channel_name = "Benchmark"
+    channel_emoji = "⏱"
+    channel_id = "benchmark.master"
+
+    def poll(self):
+        pass
+
+    def send_message(self, msg: Message) -> Message:
+        return msg
+
+    def send_status(self, status):
+        pass
+
+    def stop_polling(self):
+        pass
+
+    def get_message_by_id(self, chat, msg_id):
+        return None
+
+
+def synthesize(duration: float, seed: int, pauses: bool = False) -> bytes:
+    """
+    A WAV clip of a tone with noise, different for each seed. With
+    ``pauses``, the tone stops for 1 s every 5 s, and for 0.5 s at
+    both ends.
+    """
+    rng = random.Random(seed)
+    frequency = rng.uniform(200, 800)
+
+    def loudness(t: float) -> float:
+        if pauses and (t % 5 >= 4 or t < 0.5 or t > duration - 0.5):
+            return 0
+        return 8000
+
+    samples = (
+        int(loudness(i / SAMPLE_RATE) *
+            math.sin(2 * math.pi * frequency * i / SAMPLE_RATE) +
+            rng.gauss(0, 50 if pauses else 500))
+        for i in range(int(duration * SAMPLE_RATE)))
+    with io.BytesIO() as f:
+        with wave.open(f, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(b"".join(struct.pack("<h", s) for s in samples))
+        return f.getvalue()
+
+
+def rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Sampler:
+    """Record peak RSS and thread count in background."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, rss())
+            # Not counting the sampler itself.
+            self.peak_threads = max(self.peak_threads,
+                                    threading.active_count() - 1)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> 'Sampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(data: List[float], q: float) -> float:
+    data = sorted(data)
+    return data[min(len(data) - 1, int(q * len(data)))] if data else 0.0
+
+
+def write_config(engines: List[str], concurrency: int,
+                 http: HTTPStub, iflytek: IFlyTekStub,
+                 options: argparse.Namespace):
+    from ehforwarderbot.utils import get_config_path
+    from efb_voice_recog_middleware import VoiceRecogMiddleware
+
+    common = {"workers": concurrency, "lang": "en",
+              "async": options.asynchronous}
+    speech_api: Dict[str, Dict[str, Any]] = {
+        "baidu": dict(common, api_key="benchmark", secret_key="benchmark",
+                      token_url=f"{http.url}/oauth/2.0/token",
+                      api_url=f"{http.url}/server_api"),
+        "azure": dict(common, key1="benchmark",
+                      endpoint=f"{http.url}/speech/recognition",
+                      lang="en-US"),
+        "iflytek": dict(common, app_id="benchmark", api_key="benchmark",
+                        api_secret="benchmark", url=iflytek.url,
+                        send_mode=options.send_mode),
+        "tencent": dict(common, secret_id="benchmark",
+                        secret_key="benchmark"),
+    }
+    config = {
+        "speech_api": {k: speech_api[k] for k in engines},
+        "auto": True,
+        "dispatch": {"policy": options.policy},
+        "scheduler": {"workers": concurrency,
+                      "queue_size": max(concurrency * 2, 10)},
+        # Every message should reach the engines.
+        "cache": {"enabled": False},
+        "deadline": options.deadline,
+    }
+    if options.transcoder:
+        config["transcoder"] = {"enabled": True}
+    if options.vad:
+        config["vad"] = {"enabled": True, "max_chunk": options.vad}
+    path = get_config_path(VoiceRecogMiddleware.middleware_id)
+    with path.open('w') as f:
+        yaml.safe_dump(config, f)
+
+
+def build_middleware(engines: List[str], concurrency: int,
+                     http: HTTPStub, iflytek: IFlyTekStub,
+                     options: argparse.Namespace):
+    from efb_voice_recog_middleware import VoiceRecogMiddleware
+
+    write_config(engines, concurrency, http, iflytek, options)
+    middleware = VoiceRecogMiddleware()
+    # Edits go straight to the stand-in master channel.
+    middleware.editor.send = coordinator.master.send_message
+    for engine in middleware.voice_engines:
+        if engine.engine_name == "Tencent":
+            engine.client = FakeAsrClient(options.latency)
+    return middleware
+
+
+def run(middleware, clip: bytes, messages: int, concurrency: int,
+        timeout: float) -> Dict[str, Any]:
+    """
+    Send ``messages`` voice messages, at most ``concurrency`` at once.
+
+    Messages without a result after ``timeout`` seconds, e.g. dropped
+    from a full queue or shed, are counted as failures.
+    """
+    slots = threading.Semaphore(concurrency)
+    started: Dict[str, float] = dict()
+    finished: Set[str] = set()
+    latencies: List[float] = []
+    failures: List[str] = []
+    done = threading.Event()
+    lock = threading.Lock()
+    finish = middleware.editor.finish
+
+    def on_finish(message: Message):
+        finish(message)
+        with lock:
+            finished.add(message.uid)
+            latencies.append(time.monotonic() - started[message.uid])
+            if any(word in message.text for word in
+                   ("ERROR", "Error", "Timed out", "Failed")):
+                failures.append(message.text)
+            if len(latencies) == messages:
+                done.set()
+        slots.release()
+
+    middleware.editor.finish = on_finish
+    # Messages delivered to the master channel are recognized.
+    master = coordinator.master
+    with Sampler() as sampler:
+        begin = time.monotonic()
+        for i in range(messages):
+            # A lost message never gives its slot back.
+            slots.acquire(timeout=timeout)
+            chat = PrivateChat(module_id="benchmark.slave",
+                               module_name="Benchmark",
+                               uid=f"chat{i}", name=f"Chat {i}")
+            uid = f"message{i}"
+            message = Message(
+                type=MsgType.Voice, chat=chat, author=chat.other,
+                deliver_to=master, file=io.BytesIO(clip),
+                mime="audio/x-wav", uid=uid, text="")
+            started[uid] = time.monotonic()
+            middleware.process_message(message)
+        done.wait(timeout)
+        elapsed = time.monotonic() - begin
+    middleware.editor.finish = finish
+    with lock:
+        failures.extend(f"{uid}: no result in {timeout} s"
+                        for uid in started if uid not in finished)
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "peak_rss": sampler.peak_rss,
+        "peak_threads": sampler.peak_threads,
+        "failures": failures,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--engines", nargs="+", choices=ENGINES,
+                        default=list(ENGINES))
+    parser.add_argument("--durations", nargs="+", type=float,
+                        default=[2, 10, 30],
+                        help="Lengths of voice messages in seconds")
+    parser.add_argument("--concurrency", nargs="+", type=int,
+                        default=[1, 8],
+                        help="Numbers of messages in flight at once")
+    parser.add_argument("--messages", type=int, default=20,
+                        help="Messages sent in each run")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds each stub takes to answer")
+    parser.add_argument("--policy", default="all",
+                        help="Dispatch policy")
+    parser.add_argument("--send-mode", default="adaptive",
+                        help="IFlyTek send mode")
+    parser.add_argument("--deadline", type=float, default=60)
+    parser.add_argument("--async", dest="asynchronous", action="store_true",
+                        help="Use asyncio engines where available")
+    parser.add_argument("--transcoder", action="store_true",
+                        help="Decode in the transcoder process pool")
+    parser.add_argument("--vad", type=float, metavar="SECONDS",
+                        help="Trim silence and split clips longer than "
+                             "SECONDS at pauses (clips get pauses)")
+    parser.add_argument("--json", metavar="PATH",
+                        help="Also write results to a JSON file")
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    engines = list(options.engines)
+    if "azure" in engines and shutil.which("ffmpeg") is None:
+        print("ffmpeg is not found, skipping Azure.", file=sys.stderr)
+        engines.remove("azure")
+
+    data_path = tempfile.mkdtemp(prefix="voice_recog_benchmark_")
+    os.environ["EFB_DATA_PATH"] = data_path
+    # Registered first, so it runs after quota usage is saved at exit.
+    atexit.register(shutil.rmtree, data_path, ignore_errors=True)
+    coordinator.master = _MasterChannel()
+    http = HTTPStub(options.latency).start()
+    iflytek = IFlyTekStub(options.latency).start()
+
+    results: List[Dict[str, Any]] = []
+    print(f"Engines: {', '.join(engines)}; policy: {options.policy}; "
+          f"async: {options.asynchronous}; "
+          f"stub latency: {options.latency} s")
+    print(f"{'length':>7} {'conc':>5} {'msg/s':>8} {'p50 s':>8} "
+          f"{'p99 s':>8} {'RSS MB':>8} {'threads':>8} {'failed':>7}")
+    # Longest wait for a message, past which it is lost
+    timeout = options.deadline + 10
+    try:
+        for concurrency in options.concurrency:
+            middleware = build_middleware(engines, concurrency,
+                                          http, iflytek, options)
+            try:
+                for duration in options.durations:
+                    clip = synthesize(duration, seed=int(duration * 1000),
+                                      pauses=bool(options.vad))
+                    # Warm up connections and tokens.
+                    run(middleware, clip, min(concurrency, 2), concurrency,
+                        timeout)
+                    result = run(middleware, clip, options.messages,
+                                 concurrency, timeout)
+                    result.update(duration=duration,
+                                  concurrency=concurrency,
+                                  messages=options.messages)
+                    results.append(result)
+                    print(f"{duration:>6.1f}s {concurrency:>5} "
+                          f"{result['throughput']:>8.2f} "
+                          f"{result['p50']:>8.3f} {result['p99']:>8.3f} "
+                          f"{result['peak_rss'] / 2 ** 20:>8.1f} "
+                          f"{result['peak_threads']:>8} "
+                          f"{len(result['failures']):>7}")
+            finally:
+                middleware.close()
+    finally:
+        http.stop()
+        iflytek.stop()
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump({"engines": engines, "policy": options.policy,
+                       "latency": options.latency, "results": results},
+                      f, indent=2)
+    failures = [f for r in results for f in r["failures"]]
+    for failure in failures[:5]:
+        print("Failed:", failure.strip(), file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
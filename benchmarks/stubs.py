@@ -0,0 +1,255 @@
+"""
+Local stand-ins of the speech APIs, so benchmarks run without network.
+
+* :class:`HTTPStub`: Azure endpoint, Baidu token URL and Baidu API.
+* :class:`IFlyTekStub`: websocket server speaking the frame protocol
+  of IFlyTek ``/v2/iat``.
+* :class:`FakeAsrClient`: replaces the ``AsrClient`` of the Tencent SDK.
+
+Every stub waits ``latency`` seconds before it answers, to stand in for
+the processing time of the real service.
+"""
+import base64
+import hashlib
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+from typing import Dict, Optional
+
+TRANSCRIPT = "benchmark"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close connections of cancelled calls, e.g. with race.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _ThreadingTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Stub:
+    """A stub server running in a background thread."""
+
+    server: TCPServer
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> 'Stub':
+        threading.Thread(target=self.server.serve_forever,
+                         name=f"Benchmark {type(self).__name__}",
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HTTPStub(Stub):
+    """
+    HTTP stub of Azure and Baidu.
+
+    ``/oauth/2.0/token`` answers as the Baidu token URL, ``/server_api``
+    as the Baidu API, and every other path as the Azure endpoint.
+    Connections are kept alive, and chunked uploads are accepted.
+    """
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1"):
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding") == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0], 16)
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                        if not size:
+                            return b"".join(chunks)
+                return self.rfile.read(
+                    int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                self.read_body()
+                stub.requests += 1
+                path = self.path.split("?")[0]
+                if path == "/oauth/2.0/token":
+                    body = {"access_token": "benchmark",
+                            "expires_in": 2592000}
+                else:
+                    time.sleep(stub.latency)
+                    if path == "/server_api":
+                        body = {"err_no": 0, "err_msg": "success.",
+                                "result": [TRANSCRIPT]}
+                    else:
+                        body = {"RecognitionStatus": "Success",
+                                "NBest": [{"Display": TRANSCRIPT}]}
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # The call was cancelled, e.g. another engine won.
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer((host, 0), Handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+
+class IFlyTekStub(Stub):
+    """
+    Websocket stub of IFlyTek ``/v2/iat``.
+
+    Each connection is one recognition session: the first audio frame
+    is acknowledged with an empty partial result, and the transcript is
+    sent after the last frame, before the connection is closed.
+    Connections left idle by the pool are dropped without an error.
+    """
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1"):
+        self.latency = latency
+        self.sessions = 0
+        stub = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                if not self.handshake():
+                    return
+                try:
+                    stub.session(self)
+                except (ConnectionError, socket.timeout):
+                    pass
+
+            def handshake(self) -> bool:
+                headers: Dict[str, str] = dict()
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                while True:
+                    line = self.rfile.readline().decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                accept = base64.b64encode(hashlib.sha1(
+                    (headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()
+                ).digest()).decode()
+                self.wfile.write((
+                    "HTTP/1.1 101 Switching Protocols\r\n"
+                    "Upgrade: websocket\r\n"
+                    "Connection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+                return True
+
+        self.server = _ThreadingTCPServer((host, 0), Handler)
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/v2/iat"
+
+    def session(self, conn: StreamRequestHandler):
+        first = True
+        while True:
+            frame = self.read_frame(conn)
+            if frame is None:
+                return
+            status = json.loads(frame)["data"]["status"]
+            if first:
+                first = False
+                self.sessions += 1
+                self.write_frame(conn, self.result(1, ""))
+            if status == 2:
+                time.sleep(self.latency)
+                self.write_frame(conn, self.result(2, TRANSCRIPT))
+                self.write_frame(conn, b"", opcode=0x8)
+                return
+
+    @staticmethod
+    def result(status: int, text: str) -> bytes:
+        words = [{"cw": [{"w": text}]}] if text else []
+        return json.dumps({
+            "code": 0, "message": "success", "sid": "benchmark",
+            "data": {"status": status, "result": {"ws": words}}
+        }).encode()
+
+    def read_frame(self, conn: StreamRequestHandler) -> Optional[bytes]:
+        """Read a text frame, ``None`` if the connection is closed."""
+        while True:
+            head = conn.rfile.read(2)
+            if len(head) < 2:
+                return None
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length, = struct.unpack(">H", conn.rfile.read(2))
+            elif length == 127:
+                length, = struct.unpack(">Q", conn.rfile.read(8))
+            mask = conn.rfile.read(4) if head[1] & 0x80 else b"\0" * 4
+            payload = conn.rfile.read(length)
+            # Unmask with one big integer XOR, much faster than by byte.
+            mask = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, "big") ^
+                       int.from_bytes(mask, "big")).to_bytes(length, "big")
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self.write_frame(conn, payload, opcode=0xA)
+                continue
+            if opcode == 0x1:
+                return payload
+
+    @staticmethod
+    def write_frame(conn: StreamRequestHandler, payload: bytes,
+                    opcode: int = 0x1):
+        length = len(payload)
+        if length < 126:
+            head = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            head = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        conn.wfile.write(head + payload)
+
+
+class FakeAsrClient:
+    """Stand-in of ``tencentcloud.asr.v20190614.asr_client.AsrClient``."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.requests = 0
+
+    def SentenceRecognition(self, request):
+        from tencentcloud.asr.v20190614 import models
+        base64.b64decode(request.Data)
+        self.requests += 1
+        time.sleep(self.latency)
+        response = models.SentenceRecognitionResponse()
+        response.Result = TRANSCRIPT
+        return response
@@ -1,24 +1,36 @@
 # coding: utf-8
+import asyncio
 import logging
 import copy
+import inspect
 import threading
-import mimetypes
-from os import PathLike
+import time
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Any, Dict, Optional, List
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, Optional, List, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import yaml
-import shutil
 
 from ehforwarderbot import coordinator, Middleware, Message, MsgType
-from ehforwarderbot.utils import get_config_path
+from ehforwarderbot.chat import GroupChat
+from ehforwarderbot.utils import get_config_path, get_data_path
 from . import __version__ as version
-from .engines.baidu import BaiduSpeech
-from .engines.azure import AzureSpeech
-from .engines.iflytek import IFlyTekSpeech
-from .engines.tencent import TencentSpeech
+from . import metrics
+from .audio import AudioData, AudioSource
+from .budget import MemoryBudget
+from .cache import TranscriptionCache
+from .deadline import Deadline, DeadlineExceeded
+from .dispatch import Dispatcher, EngineResult
+from .editor import MessageEditor
+from .loop import EventLoopThread
+from .quota import QuotaStore, RateLimiter
+from .engines import AsyncSpeechEngine, SpeechEngine, is_error, \
+    load_engine
+from .scheduler import RecognitionScheduler, QueueFullError
+from .shedding import LoadShedder
+from .transcoder import NATIVE_DECODER, Transcoder
+from .vad import VoiceActivityDetector
 
 
 class VoiceRecogMiddleware(Middleware):
@@ -35,65 +47,387 @@ class VoiceRecogMiddleware(Middleware):
     logger: logging.Logger = logging.getLogger(
         "plugins.%s.VoiceRecogMiddleware" % middleware_id)
 
-    voice_engines: List = []
-
-    def __init__(self, instance_id: str = None):
+    def __init__(self, instance_id: str = None,
+                 config_path: Optional[Path] = None):
+        """
+        Arguments:
+            config_path: Config file to use instead of the one in the
+                EFB profile.
+        """
         super().__init__()
-        self.config: Dict[str: Any] = self.load_config()
+        self.config: Dict[str: Any] = self.load_config(config_path)
         engines: Dict[str, Any] = self.config.get("speech_api", dict())
         # self.lang: str = self.config.get('language', 'zh')
+        self.voice_engines: List[SpeechEngine] = []
+        # One long-lived executor per blocking engine, sized by its
+        # `workers` option.
+        self.engine_executors: Dict[SpeechEngine, ThreadPoolExecutor] = {}
+        # Asyncio engines share one event loop, and `workers` limits
+        # their calls in flight instead.
+        self.loop: Optional[EventLoopThread] = None
+        self.async_workers: Dict[SpeechEngine, int] = {}
+        self._async_slots: Dict[SpeechEngine, asyncio.Semaphore] = {}
+        # Engines whose `recognize` accepts a deadline
+        self.deadline_aware: List[SpeechEngine] = []
+        self.limiters: Dict[SpeechEngine, RateLimiter] = {}
+
+        data_path: Path = get_data_path(self.middleware_id)
+        self.quota_store = QuotaStore(data_path / "quota.json")
+        dispatch_conf: Any = self.config.get('dispatch', dict())
+        if isinstance(dispatch_conf, str):
+            dispatch_conf = {'policy': dispatch_conf}
+        # Engines listed in `order` go first, in that order.
+        order: List[str] = dispatch_conf.get('order', [])
+        keys = sorted(engines, key=lambda k: order.index(k)
+                      if k in order else len(order))
+        for key in keys:
+            conf: Dict[str, Any] = dict(engines[key])
+            try:
+                engine_class = load_engine(key, conf.get('async', False))
+            except KeyError:
+                self.logger.error("Unknown speech engine: %s", key)
+                continue
+            conf.setdefault('workers', 2)
+            # Where engines may keep their own data, e.g. access tokens.
+            conf.setdefault('data_path', str(data_path))
+            # Keep one HTTP connection alive for each worker.
+            conf.setdefault('pool_size', conf['workers'])
+            engine = engine_class(conf)
+            self.voice_engines.append(engine)
+            if 'deadline' in inspect.signature(engine.recognize).parameters:
+                self.deadline_aware.append(engine)
+            self.limiters[engine] = RateLimiter(
+                key, self.quota_store,
+                rate_limit=conf.get('rate_limit'), quota=conf.get('quota'))
+            if isinstance(engine, AsyncSpeechEngine):
+                self.async_workers[engine] = conf['workers']
+                if self.loop is None:
+                    self.loop = EventLoopThread()
+            else:
+                self.engine_executors[engine] = ThreadPoolExecutor(
+                    max_workers=conf['workers'],
+                    thread_name_prefix=f"VoiceRecog {engine.engine_name}")
+
+        self.dispatcher = Dispatcher(
+            policy=dispatch_conf.get('policy', Dispatcher.POLICY_ALL),
+            timeout=dispatch_conf.get('timeout', 10),
+            hedge_delay=dispatch_conf.get('hedge_delay', 3),
+            hedge_quantile=dispatch_conf.get('hedge_quantile', 0.9),
+            routing=dispatch_conf.get('routing', Dispatcher.ROUTING_PRIORITY),
+            health=self.config.get('health', dict()),
+            limiters=self.limiters
+        )
+
+        edit_conf: Dict[str, Any] = self.config.get('progressive', dict())
+        self.editor = MessageEditor(
+            coordinator.send_message,
+            debounce=edit_conf.get('debounce', 0.5),
+            interval=edit_conf.get('interval', 2)
+        )
+        self.progressive: bool = edit_conf.get('enabled', True)
 
-        if "baidu" in engines:
-            self.voice_engines.append(
-                BaiduSpeech(engines['baidu'])
-                )
-        if "azure" in engines:
-            self.voice_engines.append(
-                AzureSpeech(engines['azure'])
+        # Seconds allowed to recognize a voice message with all engines
+        self.deadline: Optional[float] = self.config.get('deadline', 120)
+
+        metrics.queue_depth.set_function(lambda: self.queue_depth)
+        metrics_conf: Dict[str, Any] = self.config.get('metrics', dict())
+        self.metrics_exporter = metrics.MetricsExporter()
+        if 'port' in metrics_conf:
+            self.metrics_exporter.serve_http(
+                metrics_conf.get('host', '127.0.0.1'), metrics_conf['port'])
+        if 'textfile' in metrics_conf:
+            self.metrics_exporter.write_textfile(
+                metrics_conf['textfile'], metrics_conf.get('interval', 15))
+
+        memory_conf: Dict[str, Any] = self.config.get('memory', dict())
+        self.budget: Optional[MemoryBudget] = None
+        # Megabytes of audio in flight at once
+        budget: float = memory_conf.get('budget', 256)
+        # Copies of the PCM a voice message holds at once: the shared
+        # PCM, and those of all engines, which may run at the same time.
+        self.working_copies: float = 1 + sum(
+            e.working_copies for e in self.voice_engines)
+        if budget:
+            self.budget = MemoryBudget(int(budget * 2 ** 20))
+            metrics.memory_in_use_bytes.set_function(
+                lambda: self.budget.in_use)
+
+        scheduler_conf: Dict[str, Any] = self.config.get('scheduler', dict())
+        self.scheduler = RecognitionScheduler(
+            workers=scheduler_conf.get('workers', 2),
+            queue_size=scheduler_conf.get('queue_size', 100),
+            overflow=scheduler_conf.get(
+                'overflow', RecognitionScheduler.OVERFLOW_DROP_OLDEST),
+            budget=self.budget,
+            max_age=scheduler_conf.get('max_age')
+        )
+
+        transcoder_conf: Dict[str, Any] = \
+            self.config.get('transcoder', dict())
+        self.transcoder: Optional[Transcoder] = None
+        # Only worth it with PyAV: pydub starts ffmpeg per clip anyway.
+        if transcoder_conf.get('enabled', NATIVE_DECODER):
+            self.transcoder = Transcoder(
+                processes=transcoder_conf.get('processes', 2),
+                max_tasks=transcoder_conf.get('max_tasks', 100),
+                timeout=transcoder_conf.get('timeout', 60)
             )
-        if "iflytek" in engines:
-            self.voice_engines.append(
-                IFlyTekSpeech(engines['iflytek'])
+
+        shedding_conf: Dict[str, Any] = self.config.get('shedding', dict())
+        self.shedder: Optional[LoadShedder] = None
+        if shedding_conf.get('enabled', False):
+            self.shedder = LoadShedder(
+                lambda: self.queue_depth,
+                queue_depth=shedding_conf.get('queue_depth', 20),
+                latency=shedding_conf.get('latency', 60),
+                recover=shedding_conf.get('recover', 0.5),
+                hold=shedding_conf.get('hold', 30),
+                window=shedding_conf.get('window', 120),
+                actions=shedding_conf.get('actions', LoadShedder.actions),
+                max_duration=shedding_conf.get('max_duration', 30),
+                low_priority_chats=shedding_conf.get(
+                    'low_priority_chats', []),
+                low_priority_groups=shedding_conf.get(
+                    'low_priority_groups', False)
             )
-        if "tencent" in engines:
-            self.voice_engines.append(
-                TencentSpeech(engines['tencent'])
+            # Evaluated on scrape, so the gauge also falls back to 0
+            # when load drops while no message comes in.
+            metrics.shedding.set_function(
+                lambda: int(self.shedder.update()))
+
+        vad_conf: Dict[str, Any] = self.config.get('vad', dict())
+        self.vad: Optional[VoiceActivityDetector] = None
+        if vad_conf.get('enabled', False):
+            self.vad = VoiceActivityDetector(
+                threshold=vad_conf.get('threshold', -40),
+                padding=vad_conf.get('padding', 0.3),
+                min_pause=vad_conf.get('min_pause', 0.5),
+                max_chunk=vad_conf.get('max_chunk', 15)
             )
 
-    def load_config(self) -> Optional[Dict]:
-        config_path: Path = get_config_path(self.middleware_id)
+        cache_conf: Dict[str, Any] = self.config.get('cache', dict())
+        self.cache: Optional[TranscriptionCache] = None
+        if cache_conf.get('enabled', True):
+            self.cache = TranscriptionCache(
+                path=data_path / "cache.sqlite"
+                if cache_conf.get('disk', True) else None,
+                memory_entries=cache_conf.get('memory_entries', 256),
+                disk_entries=cache_conf.get('disk_entries', 10000),
+                ttl=cache_conf.get('ttl', 30 * 24 * 3600)
+            )
+
+    def load_config(self, config_path: Optional[Path] = None) \
+            -> Optional[Dict]:
+        if config_path is None:
+            config_path = get_config_path(self.middleware_id)
+        config_path = Path(config_path)
         if not config_path.exists():
             raise FileNotFoundError('The configure file does not exist!')
         with config_path.open('r') as f:
-            d: Dict[str, Any] = yaml.load(f)
+            d: Dict[str, Any] = yaml.safe_load(f)
             if not d:
                 raise RuntimeError('Load configure file failed!')
                 return
             return d
 
-    def recognize(self, file: PathLike) -> List[str]:
+    def recognize(self, file: Union[AudioSource, AudioData]) -> List[str]:
         '''
         Recognize the audio file to text.
         :param file: An audio file. It should be FILE object in 'rb'
-            mode or string of path to the audio file.
+            mode, string of path to the audio file, bytes of the file,
+            or an :class:`.AudioData` shared by all engines.
+        '''
+        return list(self.iter_recognize(file))
+
+    def iter_recognize(self, file: Union[AudioSource, AudioData],
+                       policy: Optional[str] = None) -> Iterator[str]:
         '''
-        with ThreadPoolExecutor(max_workers=5) as exe:
-            futures = {
-                exe.submit(e.recognize, file): (e.engine_name, e.lang)
-                for e in self.voice_engines
-            }
-            results = []
-            for future in as_completed(futures):
-                engine_name, lang = futures[future]
-                try:
-                    data = "; ".join(future.result())
-                    if len(data) > 1000:
-                        data = data[:1000] + " ..."
-                    results.append(
-                        f'\n{engine_name} ({lang}): {data}')
-                except Exception as exc:
-                    results.append(f'\n{engine_name} ({lang}): {repr(exc)}')
-            return results
+        Recognize the audio file to text, yielding the result of each
+        engine as soon as it is ready.
+        :param policy: Dispatch policy, instead of the configured one.
+        '''
+        for r in self.iter_results(file, policy):
+            yield self.format_result(r)
+
+    def iter_results(self, file: Union[AudioSource, AudioData],
+                     policy: Optional[str] = None) \
+            -> Iterator[EngineResult]:
+        """
+        :meth:`iter_recognize`, yielding the outcome of each engine
+        instead of formatted text. Nothing is yielded if the clip is
+        silent.
+        """
+        audio = AudioData.of(file, transcoder=self.transcoder)
+        chunks = self.split(audio)
+        if not chunks:
+            # Nothing but silence
+            return
+        if len(chunks) == 1:
+            def submit(e: SpeechEngine, d: Deadline) -> Future:
+                return self.submit(e, chunks[0], d)
+        else:
+            def submit(e: SpeechEngine, d: Deadline) -> Future:
+                return self.submit_chunks(e, chunks, d)
+        yield from self.dispatcher.dispatch(
+            self.voice_engines, submit, Deadline(self.deadline), policy)
+
+    def split(self, audio: AudioData) -> List[AudioData]:
+        """
+        Trim silence at both ends of a clip, and split it at pauses if
+        it is long, with the voice activity detector.
+
+        Returns:
+            Chunks to recognize in order; none if the clip is silent.
+        """
+        if self.vad is None:
+            return [audio]
+        pcm = audio.pcm
+        ranges = self.vad.split(pcm)
+        if ranges == [(0, len(pcm))]:
+            # Keep the clip as it is, and its cache key with it.
+            return [audio]
+        view = memoryview(pcm)
+        return [AudioData.from_pcm(view[start:end])
+                for start, end in ranges]
+
+    @staticmethod
+    def format_result(result: EngineResult) -> str:
+        engine_name = result.engine.engine_name
+        lang = result.engine.lang
+        if isinstance(result.error, (DeadlineExceeded, FutureTimeoutError)):
+            return f'\n{engine_name} ({lang}): Timed out.'
+        if result.error is not None:
+            return f'\n{engine_name} ({lang}): {repr(result.error)}'
+        data = "; ".join(str(i) for i in result.result)
+        if len(data) > 1000:
+            data = data[:1000] + " ..."
+        return f'\n{engine_name} ({lang}): {data}'
+
+    def submit(self, engine: SpeechEngine, audio: AudioData,
+               deadline: Optional[Deadline] = None) -> Future:
+        """
+        Start recognition with one engine: blocking engines run in
+        their executor, and asyncio engines in the event loop.
+        """
+        if isinstance(engine, AsyncSpeechEngine):
+            return self.loop.submit(
+                self.recognize_async(engine, audio, deadline))
+        return self.engine_executors[engine].submit(
+            self.recognize_with, engine, audio, deadline)
+
+    def submit_chunks(self, engine: SpeechEngine, chunks: List[AudioData],
+                      deadline: Optional[Deadline] = None) -> Future:
+        """
+        Recognize chunks of a clip with one engine in parallel, up to
+        its `workers`, and join their texts in order.
+
+        The result is the error of the first chunk that failed, if any.
+        Cancelling the returned future cancels all chunks.
+        """
+        joined: Future = Future()
+        futures = [self.submit(engine, chunk, deadline) for chunk in chunks]
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_: Future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] or not joined.set_running_or_notify_cancel():
+                    return
+            texts: List[str] = []
+            try:
+                for f in futures:
+                    result = f.result()
+                    if is_error(result):
+                        joined.set_result(result)
+                        return
+                    texts.extend(result[:1])
+                joined.set_result([" ".join(t for t in texts if t)])
+            except BaseException as e:
+                joined.set_exception(e)
+
+        def cancelled(f: Future):
+            if f.cancelled():
+                for i in futures:
+                    i.cancel()
+
+        joined.add_done_callback(cancelled)
+        for f in futures:
+            f.add_done_callback(done)
+        return joined
+
+    def recognize_with(self, engine: SpeechEngine, audio: AudioData,
+                       deadline: Optional[Deadline] = None) -> List[str]:
+        """Recognize with one engine, checking the cache first."""
+        def compute() -> List[str]:
+            if deadline is not None:
+                deadline.check()
+            # Decoded on a cache miss only, and outside of the engine
+            # timer.
+            duration = audio.duration
+            # Only calls that reach the engine count towards its quota.
+            self.limiters[engine].acquire(duration, deadline)
+            with metrics.engine_seconds.time(engine=engine.engine_name):
+                if deadline is not None and engine in self.deadline_aware:
+                    return engine.recognize(audio, deadline=deadline)
+                return engine.recognize(audio)
+
+        if self.cache is None:
+            return compute()
+        key = (audio.digest, engine.engine_name, engine.lang)
+        return self.cache.get_or_compute(
+            key, compute, deadline.remaining() if deadline else None)
+
+    async def recognize_async(self, engine: AsyncSpeechEngine,
+                              audio: AudioData,
+                              deadline: Optional[Deadline] = None) \
+            -> List[str]:
+        """:meth:`recognize_with` for asyncio engines, in the event loop."""
+        async def compute() -> List[str]:
+            if deadline is not None:
+                deadline.check()
+            if engine not in self._async_slots:
+                # Created here to bind to the running loop.
+                self._async_slots[engine] = asyncio.Semaphore(
+                    self.async_workers[engine])
+            async with self._async_slots[engine]:
+                # Decoded on a cache miss only, and outside of the
+                # engine timer; decoding blocks.
+                duration = await engine.run_blocking(
+                    lambda: audio.duration)
+                await engine.run_blocking(self.limiters[engine].acquire,
+                                          duration, deadline)
+                with metrics.engine_seconds.time(engine=engine.engine_name):
+                    return await engine.recognize(audio, deadline=deadline)
+
+        if self.cache is None:
+            return await compute()
+        digest = await engine.run_blocking(lambda: audio.digest)
+        return await self.cache.get_or_compute_async(
+            (digest, engine.engine_name, engine.lang), compute,
+            deadline.remaining() if deadline else None)
+
+    def close(self):
+        """
+        Stop the workers and close the engines, e.g. when the middleware
+        is used outside of EFB.
+        """
+        self.scheduler.shutdown()
+        for executor in self.engine_executors.values():
+            executor.shutdown(wait=True)
+        if self.loop is not None:
+            for engine in self.async_workers:
+                self.loop.submit(engine.close()).result()
+            self.loop.stop()
+        if self.transcoder is not None:
+            self.transcoder.close()
+        self.metrics_exporter.close()
+        self.quota_store.save()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of voice messages waiting to be recognized."""
+        return self.scheduler.qsize
 
     @staticmethod
     def sent_by_master(message: Message) -> bool:
@@ -129,12 +463,20 @@ class VoiceRecogMiddleware(Middleware):
             if not drop:
                 return message
 
-        audio: NamedTemporaryFile = NamedTemporaryFile(
-            suffix=mimetypes.guess_extension(audio_msg.mime)
-        )
-        shutil.copyfileobj(audio_msg.file, audio)
-        audio.seek(0)
-        audio_msg.file.seek(0)
+        if not drop and self.shedder is not None and \
+                self.shedder.low_priority(
+                    audio_msg.chat.uid,
+                    isinstance(audio_msg.chat, GroupChat)) and \
+                self.shedder.active(LoadShedder.ACTION_LOW_PRIORITY):
+            metrics.shed.inc(action=LoadShedder.ACTION_LOW_PRIORITY)
+            return message
+
+        received = time.monotonic()
+        with metrics.copy_seconds.time():
+            # The file on disk is reopened, or small clips are kept in
+            # memory, instead of copied to a temporary file.
+            audio = AudioData.adopt(audio_msg.file, audio_msg.path,
+                                    audio_msg.mime, self.transcoder)
         edited = copy.copy(audio_msg)
 
         # necessary because copy.copy can't deal with chat of replied message
@@ -143,28 +485,63 @@ class VoiceRecogMiddleware(Middleware):
         if self.sent_by_master(message):
             edited.author = copy.copy(message.target.author)
 
-        threading.Thread(
-            target=self.process_audio,
-            args=(edited, audio),
-            name=f"VoiceRecog thread {audio_msg.uid}"
-            ).start()
+        try:
+            cost = audio.estimate_memory(self.working_copies)
+        except (OSError, ValueError):
+            cost = 0
+        try:
+            self.scheduler.submit(self.process_audio, edited, audio, received,
+                                  not drop, auto=not drop, on_drop=audio.close,
+                                  cost=cost, chat=(edited.chat.module_id,
+                                                   edited.chat.uid))
+        except QueueFullError:
+            self.logger.warning("Recognition queue is full, "
+                                "skipped voice message %s.", audio_msg.uid)
+            audio.close()
         if not drop:
             return message
 
-    def process_audio(self, message: Message, audio: NamedTemporaryFile):
+    @staticmethod
+    def build_edit(message: Message, results: List[str]) -> Message:
+        """Make an edit of ``message`` with recognition results."""
+        edited = copy.copy(message)
+        edited.text = ((message.text or "") + '\n'.join(results))[:4000]
+        # message.file = None
+        edited.edit = True
+        edited.edit_media = False
+        return edited
+
+    def process_audio(self, message: Message, audio: AudioData,
+                      received: Optional[float] = None, auto: bool = False):
+        results: List[str] = []
         try:
-            # reply_text: str = '\n'.join(self.recognize(audio.name, self.lang))
-            reply_text: str = '\n'.join(self.recognize(audio.name))
+            policy = None
+            if auto and self.shedder is not None:
+                # Estimated, not to decode a clip only to skip it.
+                if self.shedder.active(LoadShedder.ACTION_SKIP_LONG) and \
+                        audio.estimated_duration > self.shedder.max_duration:
+                    metrics.shed.inc(action=LoadShedder.ACTION_SKIP_LONG)
+                    audio.close()
+                    return
+                if self.shedder.active(LoadShedder.ACTION_SINGLE_ENGINE):
+                    metrics.shed.inc(
+                        action=LoadShedder.ACTION_SINGLE_ENGINE)
+                    policy = Dispatcher.POLICY_CASCADE
+            # Decode once, and share the PCM among all engines.
+            for result in self.iter_recognize(audio, policy):
+                results.append(result)
+                if self.progressive:
+                    self.editor.update(self.build_edit(message, results))
         except Exception:
-            reply_text = 'Failed to recognize voice content.'
-        if getattr(message, 'text', None) is None:
-            message.text = ""
-        message.text += reply_text
-        message.text = message.text[:4000]
+            self.logger.exception("Failed to recognize voice content.")
+            results.append('Failed to recognize voice content.')
 
-        # message.file = None
-        message.edit = True
-        message.edit_media = False
-        coordinator.send_message(message)
+        if results:
+            self.editor.finish(self.build_edit(message, results))
+        # else the clip is silent, and the message is left as it is.
+        if received is not None:
+            metrics.end_to_end_seconds.observe(time.monotonic() - received)
+            if self.shedder is not None:
+                self.shedder.record(time.monotonic() - received)
 
         audio.close()
@@ -0,0 +1,388 @@
+import binascii
+import hashlib
+import mimetypes
+import os
+import struct
+import threading
+import wave
+from contextlib import contextmanager
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, IO, Iterator, Optional, Union, TYPE_CHECKING
+from os import PathLike
+
+from . import metrics
+
+if TYPE_CHECKING:
+    import pydub
+    from .transcoder import Transcoder
+
+AudioSource = Union[str, PathLike, IO[bytes], bytes, bytearray, memoryview]
+"""Path, file object in `rb` mode, or bytes of an audio file"""
+
+
+class AudioData:
+    """
+    Decode-once container of a voice clip.
+
+    The source file is decoded only once into 16 kHz mono 16-bit PCM,
+    which is shared by all speech engines. Each derived format
+    (raw PCM, WAV, Ogg/Opus, ...) is built at most once and cached.
+    """
+
+    sample_rate: int = 16000
+    channels: int = 1
+    sample_width: int = 2
+    # Clips up to this size are kept in memory by :meth:`adopt`.
+    spool_size: int = 4 * 1024 * 1024
+    # Bytes of PCM per byte of a compressed voice file (e.g. Opus or
+    # SILK at about 16 kbps), to estimate memory before decoding.
+    expansion_ratio: int = 16
+    # Copies of the PCM held at once while engines run, e.g. the PCM,
+    # its base64 text, and a JSON body embedding it, unless the engines
+    # are known.
+    working_copies: float = 4
+
+    def __init__(self, source: AudioSource, format: Optional[str] = None,
+                 transcoder: Optional['Transcoder'] = None):
+        """
+        Arguments:
+            source -- path to the audio file, a file object in `rb` mode,
+                or the bytes of the file.
+            format -- format of the file for the decoder, if known.
+            transcoder -- pool of decoder processes, or ``None`` to
+                decode in this process.
+        """
+        self.source = source
+        self.format = format
+        self.transcoder = transcoder
+        # Where the audio starts in a file object
+        self._start = self._tell(source) or 0
+        # File opened by :meth:`adopt`, closed with :meth:`close`
+        self._owned: Optional[IO[bytes]] = None
+        self._segment: 'pydub.AudioSegment' = None
+        self._digest: str = None
+        self._formats: Dict[Any, bytes] = dict()
+        self._lock = threading.Lock()
+        self._format_locks: Dict[Any, threading.Lock] = dict()
+
+    @classmethod
+    def of(cls, file: Union['AudioData', AudioSource],
+           transcoder: Optional['Transcoder'] = None) -> 'AudioData':
+        """Wrap ``file`` in an :class:`AudioData` if it is not one yet."""
+        if isinstance(file, cls):
+            return file
+        return cls(file, transcoder=transcoder)
+
+    @classmethod
+    def from_pcm(cls, pcm: Union[bytes, memoryview]) -> 'AudioData':
+        """A clip of 16 kHz mono 16-bit PCM, e.g. a chunk of another."""
+        pcm = bytes(pcm)
+        audio = cls(pcm, format="s16le")
+        audio._formats["s16le"] = pcm
+        return audio
+
+    @classmethod
+    def supports(cls, file: Any) -> bool:
+        """If ``file`` can be wrapped by :meth:`of`."""
+        return isinstance(file, (cls, str, PathLike, bytes, bytearray,
+                                 memoryview)) or hasattr(file, 'read')
+
+    @classmethod
+    def adopt(cls, file: Optional[IO[bytes]], path: Optional[str] = None,
+              mime: Optional[str] = None,
+              transcoder: Optional['Transcoder'] = None) -> 'AudioData':
+        """
+        Take over the audio file of a message, which its owner may close
+        or delete afterwards.
+
+        If the file is on disk, it is opened again instead of copied:
+        the new descriptor stays valid even after the file is deleted.
+        Otherwise its content is copied to a spooled buffer, which stays
+        in memory up to :attr:`spool_size` bytes.
+
+        Arguments:
+            file: File object of the message.
+            path: Path of the file, if known.
+            mime: MIME type of the file.
+            transcoder: Pool of decoder processes, if any.
+        """
+        ext = mimetypes.guess_extension(mime) if mime else None
+        # Only WAV is decoded without ffmpeg, which detects other formats.
+        fmt = "wav" if ext == ".wav" or mime in ("audio/wav", "audio/x-wav") \
+            else None
+        name = getattr(file, 'name', None)
+        for candidate in (path, name):
+            if isinstance(candidate, (str, PathLike)) and \
+                    os.path.isfile(candidate):
+                owned = open(candidate, 'rb')
+                break
+        else:
+            owned = SpooledTemporaryFile(max_size=cls.spool_size)
+            pos = cls._tell(file)
+            for chunk in iter(lambda: file.read(65536), b''):
+                owned.write(chunk)
+            if pos is not None:
+                file.seek(pos)
+            owned.seek(0)
+        audio = cls(owned, format=fmt, transcoder=transcoder)
+        audio._owned = owned
+        return audio
+
+    @staticmethod
+    def _tell(file: Any) -> Optional[int]:
+        """Position of a seekable file object, ``None`` otherwise."""
+        try:
+            return file.tell() if hasattr(file, 'read') else None
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def size(self) -> int:
+        """Size of the source file in bytes."""
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return len(memoryview(self.source).cast('B'))
+        if isinstance(self.source, (str, PathLike)):
+            return os.path.getsize(self.source)
+        with self._lock:
+            end = self.source.seek(0, os.SEEK_END)
+            self.source.seek(self._start)
+            return end - self._start
+
+    def estimate_memory(self, working_copies: Optional[float] = None) \
+            -> int:
+        """
+        Estimated peak memory in bytes while the clip is recognized,
+        from the decoded PCM, or from the size of the file before it is
+        decoded.
+
+        Arguments:
+            working_copies: Copies of the PCM held at once, default to
+                :attr:`working_copies`.
+        """
+        if "s16le" in self._formats:
+            pcm_size = len(self._formats["s16le"])
+        else:
+            size = self.size
+            pcm_size = size if self.format == "wav" \
+                else size * self.expansion_ratio
+        if working_copies is None:
+            working_copies = self.working_copies
+        return int(working_copies * pcm_size)
+
+    @property
+    def estimated_duration(self) -> float:
+        """
+        Duration of the clip in seconds, without decoding it: from the
+        PCM once decoded, from the header of a WAV file, or from the
+        size of a compressed file.
+        """
+        bytes_per_second = \
+            self.sample_rate * self.channels * self.sample_width
+        if "s16le" in self._formats:
+            return len(self._formats["s16le"]) / bytes_per_second
+        size = self.size
+        if self.format != "wav":
+            return size * self.expansion_ratio / bytes_per_second
+        with self._lock, self._open() as f:
+            header = f.read(44)
+        if len(header) == 44 and header[:4] == b'RIFF' and \
+                header[8:12] == b'WAVE':
+            # Byte rate in the canonical header written by :mod:`wave`
+            byte_rate = struct.unpack('<I', header[28:32])[0]
+            if byte_rate:
+                return (size - 44) / byte_rate
+        return size / bytes_per_second
+
+    def close(self):
+        """
+        Close the file opened by :meth:`adopt`, and free the decoded
+        audio.
+        """
+        if self._owned is not None:
+            self._owned.close()
+        with self._lock:
+            self._segment = None
+            self._formats.clear()
+
+    @contextmanager
+    def _open(self) -> Iterator[IO[bytes]]:
+        """The source as a file object at its start. Lock must be held."""
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            yield BytesIO(self.source)
+        elif hasattr(self.source, 'read'):
+            self.source.seek(self._start)
+            yield self.source
+        else:
+            with open(self.source, 'rb') as f:
+                yield f
+
+    @contextmanager
+    def _decoder_input(self) -> Iterator[Union[str, PathLike, IO[bytes]]]:
+        """
+        What is given to the decoder. Lock must be held.
+
+        ffmpeg reads a file on disk by itself, instead of having it
+        piped by pydub. An adopted file is read through its descriptor,
+        even if it is deleted, also from decoder processes.
+        """
+        if isinstance(self.source, (str, PathLike)):
+            yield self.source
+            return
+        if self._owned is not None and \
+                not isinstance(self._owned, SpooledTemporaryFile):
+            fd_path = f"/proc/{os.getpid()}/fd/{self._owned.fileno()}"
+            if os.path.exists(fd_path):
+                yield fd_path
+                return
+        with self._open() as f:
+            yield f
+
+    @property
+    def segment(self) -> 'pydub.AudioSegment':
+        """The decoded 16 kHz mono 16-bit audio segment."""
+        if self._segment is None:
+            import pydub
+            with self._lock:
+                if self._segment is None and self.format == "s16le":
+                    # Raw PCM of :meth:`from_pcm`, nothing to decode.
+                    self._segment = pydub.AudioSegment(
+                        data=bytes(self.source),
+                        sample_width=self.sample_width,
+                        frame_rate=self.sample_rate,
+                        channels=self.channels)
+                elif self._segment is None:
+                    with metrics.decode_seconds.time(), \
+                            self._decoder_input() as source:
+                        if self.transcoder is not None:
+                            self._segment = pydub.AudioSegment(
+                                data=self._transcode(source),
+                                sample_width=self.sample_width,
+                                frame_rate=self.sample_rate,
+                                channels=self.channels)
+                        else:
+                            self._segment = pydub.AudioSegment.from_file(
+                                source, format=self.format)\
+                                .set_frame_rate(self.sample_rate)\
+                                .set_channels(self.channels)\
+                                .set_sample_width(self.sample_width)
+        return self._segment
+
+    def _transcode(self, source: Union[str, PathLike, IO[bytes]]) -> bytes:
+        """Decode in the transcoder. Paths are sent instead of content."""
+        if isinstance(source, (str, PathLike)):
+            source = os.fspath(source)
+        else:
+            source = source.read()
+        return self.transcoder.decode(
+            source, self.format, self.sample_rate, self.channels,
+            self.sample_width)
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the source file, computed without decoding it."""
+        if self._digest is None:
+            with self._lock:
+                if self._digest is None:
+                    h = hashlib.sha256()
+                    if isinstance(self.source,
+                                  (bytes, bytearray, memoryview)):
+                        h.update(self.source)
+                    else:
+                        with self._open() as f:
+                            self._hash_file(h, f)
+                    self._digest = h.hexdigest()
+        return self._digest
+
+    @staticmethod
+    def _hash_file(h, f: IO[bytes]):
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+
+    @property
+    def duration(self) -> float:
+        """Duration of the clip in seconds."""
+        return len(self.pcm) / (
+            self.sample_rate * self.channels * self.sample_width)
+
+    def _derive(self, key: Any, build) -> bytes:
+        """Build a derived format at most once."""
+        if key in self._formats:
+            return self._formats[key]
+        with self._lock:
+            lock = self._format_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._formats:
+                self._formats[key] = build()
+        return self._formats[key]
+
+    @property
+    def pcm(self) -> bytes:
+        """Raw signed 16-bit little-endian PCM (s16le)."""
+        return self._derive("s16le", lambda: self.segment.raw_data)
+
+    @property
+    def wav(self) -> bytes:
+        """PCM wrapped in a WAV container."""
+        def build() -> bytes:
+            with BytesIO() as f:
+                with wave.open(f, 'wb') as w:
+                    w.setnchannels(self.channels)
+                    w.setsampwidth(self.sample_width)
+                    w.setframerate(self.sample_rate)
+                    w.writeframes(self.pcm)
+                return f.getvalue()
+        return self._derive("wav", build)
+
+    @property
+    def wav_header(self) -> bytes:
+        """Header of :attr:`wav`, without the PCM."""
+        size = len(self.pcm)
+        block_align = self.channels * self.sample_width
+        # The canonical 44-byte header written by :mod:`wave`.
+        return struct.pack(
+            '<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size, b'WAVE', b'fmt ', 16,
+            1, self.channels, self.sample_rate,
+            self.sample_rate * block_align, block_align,
+            self.sample_width * 8, b'data', size)
+
+    def wav_base64(self, chunk_size: int = 3 * 65536) -> str:
+        """
+        :attr:`wav` encoded in base64, without building the WAV: PCM is
+        encoded in slices into a buffer of the final length, so the
+        peak is that buffer and the returned text.
+        """
+        header = self.wav_header
+        pcm = memoryview(self.pcm)
+        # Base64 of slices can be joined if each is a multiple of 3 bytes.
+        head = 3 - len(header) % 3 if len(header) % 3 else 0
+        chunk_size = max(3, chunk_size - chunk_size % 3)
+        buffer = bytearray(4 * ((len(header) + len(pcm) + 2) // 3))
+        first = binascii.b2a_base64(header + pcm[:head], newline=False)
+        buffer[:len(first)] = first
+        offset = len(first)
+        for i in range(head, len(pcm), chunk_size):
+            part = binascii.b2a_base64(pcm[i:i + chunk_size], newline=False)
+            buffer[offset:offset + len(part)] = part
+            offset += len(part)
+        return buffer.decode('ascii')
+
+    def export(self, format: str, **kwargs) -> bytes:
+        """
+        Encode the audio with ffmpeg, e.g. to Ogg/Opus.
+
+        The result is cached per format and encoder arguments.
+        """
+        key = (format, tuple(sorted(kwargs.items())))
+
+        def build() -> bytes:
+            segment = self.segment
+            with BytesIO() as f, metrics.encode_seconds.time(format=format):
+                segment.export(f, format=format, **kwargs)
+                return f.getvalue()
+        return self._derive(key, build)
+
+    @property
+    def ogg_opus(self) -> bytes:
+        """Ogg/Opus encoded audio at 16 kbps."""
+        return self.export("ogg", codec="libopus", bitrate="16k")
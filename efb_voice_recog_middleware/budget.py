@@ -0,0 +1,41 @@
+import threading
+from typing import Optional
+
+
+class MemoryBudget:
+    """
+    Bytes of audio allowed in flight at once, in this process.
+
+    Jobs reserve their estimated memory before they run, and wait while
+    the budget is used up. A job larger than the whole budget is let in
+    alone, so it still runs eventually.
+    """
+
+    def __init__(self, limit: int):
+        """
+        Arguments:
+            limit: Budget in bytes.
+        """
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int, timeout: Optional[float] = None) -> bool:
+        """
+        Reserve ``size`` bytes, waiting until they are free.
+
+        Returns:
+            ``False`` if they are not free before ``timeout``.
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self.in_use == 0 or
+                    self.in_use + size <= self.limit, timeout):
+                return False
+            self.in_use += size
+            return True
+
+    def release(self, size: int):
+        with self._cond:
+            self.in_use = max(0, self.in_use - size)
+            self._cond.notify_all()
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+from .deadline import DeadlineExceeded
+from .engines import is_error
+
+CacheKey = Tuple[str, str, str]
+"""Cache key: (audio digest, engine name, language)"""
+
+
+class TranscriptionCache:
+    """
+    Content-addressed cache of recognition results.
+
+    Results are kept in an in-memory LRU tier, backed by an optional
+    SQLite tier on disk. Entries expire after ``ttl`` seconds. Concurrent
+    lookups of the same missing key are merged, so only one of them
+    calls the speech engine. If that call is cancelled, e.g. because
+    another engine has won a race, the others compute again instead.
+    """
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.TranscriptionCache")
+
+    def __init__(self, path: Optional[Path] = None,
+                 memory_entries: int = 256, disk_entries: int = 10000,
+                 ttl: float = 30 * 24 * 3600):
+        """
+        Arguments:
+            path: Path to the SQLite database. Disk tier is disabled
+                if ``None``.
+            memory_entries: Size cap of the in-memory tier.
+            disk_entries: Size cap of the on-disk tier.
+            ttl: Time to live of an entry in seconds.
+        """
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[CacheKey, Tuple[float, List[str]]]" = \
+            OrderedDict()
+        self._inflight: Dict[CacheKey, Future] = dict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "digest TEXT, engine TEXT, lang TEXT, result TEXT, "
+                    "created REAL, accessed REAL, "
+                    "PRIMARY KEY (digest, engine, lang))")
+
+    def get(self, key: CacheKey) -> Optional[List[str]]:
+        """Look up a result, or ``None`` if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                created, result = self._memory[key]
+                if now - created < self.ttl:
+                    self._memory.move_to_end(key)
+                    return result
+                del self._memory[key]
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT result, created FROM results "
+                "WHERE digest = ? AND engine = ? AND lang = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] >= self.ttl:
+                with self._db:
+                    self._db.execute(
+                        "DELETE FROM results "
+                        "WHERE digest = ? AND engine = ? AND lang = ?", key)
+                return None
+            with self._db:
+                self._db.execute(
+                    "UPDATE results SET accessed = ? "
+                    "WHERE digest = ? AND engine = ? AND lang = ?",
+                    (now, *key))
+            result = json.loads(row[0])
+            self._remember(key, row[1], result)
+            return result
+
+    def put(self, key: CacheKey, result: List[str]):
+        """Store a result in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, result)
+            if self._db is None:
+                return
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, json.dumps(result), now, now))
+                self._db.execute(
+                    "DELETE FROM results WHERE created < ?",
+                    (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM results WHERE rowid IN ("
+                    "SELECT rowid FROM results ORDER BY accessed DESC "
+                    "LIMIT -1 OFFSET ?)", (self.disk_entries,))
+
+    def _remember(self, key: CacheKey, created: float, result: List[str]):
+        """Put an entry into the memory tier. Lock must be held."""
+        self._memory[key] = (created, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_or_compute(self, key: CacheKey,
+                       compute: Callable[[], List[str]],
+                       timeout: Optional[float] = None) -> List[str]:
+        """
+        Return the cached result of ``key``, or compute and cache it.
+
+        If another thread is already computing the same key, wait for
+        its result instead, for at most ``timeout`` seconds. Errors are
+        returned but not cached.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = self.get(key)
+            if result is not None:
+                metrics.cache_hits.inc(engine=key[1])
+                return result
+            metrics.cache_misses.inc(engine=key[1])
+            future, leader = self._lead(key)
+            if leader:
+                break
+            result = future.result(
+                None if end is None else max(0, end - time.monotonic()))
+            if result is not None:
+                return result
+            # The leader was cancelled, which is not ours to inherit.
+        try:
+            result = compute()
+        except (DeadlineExceeded, CancelledError):
+            self._follow_up(key, future, None)
+            raise
+        except BaseException as e:
+            self._follow_up(key, future, exception=e)
+            raise
+        if not is_error(result):
+            self.put(key, result)
+        self._follow_up(key, future, result)
+        return result
+
+    def _lead(self, key: CacheKey) -> Tuple[Future, bool]:
+        """
+        The future of ``key`` being computed, and if the caller is to
+        compute it.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                return future, True
+            return future, False
+
+    def _follow_up(self, key: CacheKey, future: Future,
+                   result: Optional[List[str]] = None,
+                   exception: Optional[BaseException] = None):
+        """
+        Pass the outcome of the leader to merged lookups; ``None`` tells
+        them to compute again.
+        """
+        with self._lock:
+            del self._inflight[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def get_or_compute_async(
+            self, key: CacheKey, compute: Callable[[], Awaitable[List[str]]],
+            timeout: Optional[float] = None) -> List[str]:
+        """
+        :meth:`get_or_compute` for coroutines. Lookups and writes of the
+        disk tier run in the default executor of the loop.
+        """
+        loop = asyncio.get_event_loop()
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = await loop.run_in_executor(None, self.get, key)
+            if result is not None:
+                metrics.cache_hits.inc(engine=key[1])
+                return result
+            metrics.cache_misses.inc(engine=key[1])
+            future, leader = self._lead(key)
+            if leader:
+                break
+            # Shielded, so giving up does not cancel the leader's future.
+            result = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)),
+                None if end is None else max(0, end - time.monotonic()))
+            if result is not None:
+                return result
+        try:
+            result = await compute()
+        except (DeadlineExceeded, CancelledError, asyncio.CancelledError):
+            self._follow_up(key, future, None)
+            raise
+        except BaseException as e:
+            self._follow_up(key, future, exception=e)
+            raise
+        if not is_error(result):
+            try:
+                await loop.run_in_executor(None, self.put, key, result)
+            except BaseException as e:
+                self._follow_up(key, future, exception=e)
+                raise
+        self._follow_up(key, future, result)
+        return result
@@ -0,0 +1,234 @@
+"""
+Transcribe voice files with the speech engines of the middleware,
+outside of EFB.
+
+Files are given as directories (searched recursively for audio files),
+paths, or manifests listing one path per line. Results are written to a
+JSON Lines file, one line per file with the text or error of each engine
+and timing. The output file is also the checkpoint: when the command is
+run again, files already in it are skipped.
+
+Usage::
+
+    python -m efb_voice_recog_middleware archive/ -o results.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from ehforwarderbot import coordinator
+
+AUDIO_EXTENSIONS = (".amr", ".aac", ".flac", ".m4a", ".mp3", ".oga", ".ogg",
+                    ".opus", ".silk", ".wav", ".webm")
+"""Extensions of files picked from directories"""
+
+logger: logging.Logger = logging.getLogger(
+    "plugins.catbaron.voice_recog.cli")
+
+
+def find_files(inputs: List[str], manifests: List[str],
+               extensions: List[str]) -> Iterator[str]:
+    """
+    Paths of voice files in ``inputs`` and ``manifests``, in order and
+    without duplicates.
+    """
+    seen: Set[str] = set()
+
+    def new(path: str) -> bool:
+        if path in seen:
+            return False
+        seen.add(path)
+        return True
+
+    for manifest in manifests:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    path = os.path.join(base, os.path.expanduser(line))
+                    if new(os.path.normpath(path)):
+                        yield os.path.normpath(path)
+    for item in inputs:
+        if not os.path.isdir(item):
+            if new(os.path.abspath(item)):
+                yield os.path.abspath(item)
+            continue
+        for root, dirs, files in os.walk(item):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(tuple(extensions)):
+                    path = os.path.abspath(os.path.join(root, name))
+                    if new(path):
+                        yield path
+
+
+def load_checkpoint(output: str, retry_failed: bool) -> Set[str]:
+    """Paths already transcribed in the output file."""
+    done: Set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short when the last run was killed
+                continue
+            if retry_failed and record.get("status") == "failed":
+                done.discard(record["path"])
+            else:
+                done.add(record["path"])
+    return done
+
+
+def transcribe(middleware, path: str) -> Dict[str, Any]:
+    """Recognize one file with all engines, as a JSON record."""
+    from .audio import AudioData
+
+    record: Dict[str, Any] = {"path": path, "results": []}
+    started = time.monotonic()
+    audio = AudioData(path, transcoder=middleware.transcoder)
+    cost = 0
+    try:
+        if middleware.budget is not None:
+            cost = audio.estimate_memory(middleware.working_copies)
+            middleware.budget.acquire(cost)
+        for r in middleware.iter_results(audio):
+            error = r.error
+            if error is None and r.failed:
+                error = "; ".join(str(i) for i in r.result[1:])
+            record["results"].append({
+                "engine": r.engine.engine_name,
+                "lang": r.engine.lang,
+                "text": None if r.failed
+                else "; ".join(str(i) for i in r.result),
+                "error": None if error is None else str(error) or repr(error),
+                "seconds": round(r.latency, 3),
+            })
+        record["audio_seconds"] = round(audio.duration, 3)
+        if not record["results"]:
+            record["status"] = "silent"
+        elif any(r["text"] is not None for r in record["results"]):
+            record["status"] = "ok"
+        else:
+            record["status"] = "failed"
+    except Exception as e:
+        logger.debug("Failed to transcribe %s.", path, exc_info=True)
+        record.update(status="failed", error=repr(e))
+    finally:
+        if cost:
+            middleware.budget.release(cost)
+        audio.close()
+    record["seconds"] = round(time.monotonic() - started, 3)
+    return record
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="efb-voice-recog",
+        description=__doc__.split("\n\n")[1].replace("\n", " "))
+    parser.add_argument("inputs", nargs="*", metavar="PATH",
+                        help="Voice files, or directories of them")
+    parser.add_argument("-m", "--manifest", action="append", default=[],
+                        help="File listing one path per line, relative "
+                             "to the manifest")
+    parser.add_argument("-o", "--output", default="transcripts.jsonl",
+                        help="JSON Lines file of results, appended to "
+                             "(default: %(default)s)")
+    parser.add_argument("-j", "--concurrency", type=int, default=4,
+                        help="Files transcribed at once "
+                             "(default: %(default)s)")
+    parser.add_argument("-c", "--config", type=Path,
+                        help="Config file, instead of the one in the "
+                             "EFB profile")
+    parser.add_argument("-p", "--profile", default="default",
+                        help="EFB profile (default: %(default)s)")
+    parser.add_argument("--extensions", nargs="+",
+                        default=list(AUDIO_EXTENSIONS),
+                        help="Extensions of files picked from directories")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Transcribe again files that failed")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    options = parser.parse_args(argv)
+    if not options.inputs and not options.manifest:
+        parser.error("no voice files or manifests are given")
+
+    logging.basicConfig(
+        level=logging.DEBUG if options.verbose else logging.WARNING)
+    # Where the config and data of the middleware are found; the
+    # coordinator itself is not started.
+    coordinator.profile = options.profile
+
+    from . import VoiceRecogMiddleware
+
+    done = load_checkpoint(options.output, options.retry_failed)
+    paths = [p for p in find_files(options.inputs, options.manifest,
+                                   options.extensions) if p not in done]
+    print(f"{len(paths)} files to transcribe, "
+          f"{len(done)} already in {options.output}.", file=sys.stderr)
+    if not paths:
+        return 0
+
+    middleware = VoiceRecogMiddleware(config_path=options.config)
+    if not middleware.voice_engines:
+        print("No speech engine is configured.", file=sys.stderr)
+        return 1
+    lock = threading.Lock()
+    # Files submitted but not finished, to keep memory bounded
+    slots = threading.BoundedSemaphore(max(1, options.concurrency) * 2)
+    counts: Dict[str, int] = dict()
+
+    with open(options.output, "a") as output:
+        def finish(path: str, future: Future):
+            try:
+                try:
+                    record = future.result()
+                except BaseException as e:
+                    # Not caught by transcribe, e.g. a cancelled job
+                    record = {"path": path, "results": [],
+                              "status": "failed", "error": repr(e),
+                              "seconds": 0.0}
+                with lock:
+                    output.write(
+                        json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                    counts[record["status"]] = \
+                        counts.get(record["status"], 0) + 1
+                    n = sum(counts.values())
+                    print(f"[{n}/{len(paths)}] {record['status']:>6} "
+                          f"{record['seconds']:>7.2f}s {record['path']}",
+                          file=sys.stderr)
+            finally:
+                # Always, or the run hangs once every slot is lost.
+                slots.release()
+
+        try:
+            with ThreadPoolExecutor(
+                    max(1, options.concurrency),
+                    thread_name_prefix="VoiceRecog batch") as executor:
+                for path in paths:
+                    slots.acquire()
+                    executor.submit(transcribe, middleware, path)\
+                        .add_done_callback(
+                            lambda f, path=path: finish(path, f))
+        except KeyboardInterrupt:
+            print("Interrupted, run again to resume.", file=sys.stderr)
+            return 130
+        finally:
+            middleware.close()
+
+    print(", ".join(f"{v} {k}" for k, v in sorted(counts.items())),
+          file=sys.stderr)
+    return 1 if counts.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call runs out of time or is cancelled."""
+
+
+class Deadline:
+    """
+    Time limit and cancellation signal passed down to speech engines.
+
+    Engines should bound blocking calls with :meth:`timeout`, and
+    register a callback with :meth:`on_cancel` to close their sockets
+    when the call is cancelled.
+    """
+
+    def __init__(self, timeout: Optional[float] = None,
+                 expires_at: Optional[float] = None):
+        """
+        Arguments:
+            timeout: Seconds from now, ``None`` for no limit.
+            expires_at: Absolute expiry time on the ``time.monotonic``
+                clock. Overrides ``timeout``.
+        """
+        if expires_at is None and timeout is not None:
+            expires_at = time.monotonic() + timeout
+        self.expires_at = expires_at
+        self.cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def child(self) -> 'Deadline':
+        """A deadline with the same expiry, cancelled along with this one."""
+        child = Deadline(expires_at=self.expires_at)
+        self.on_cancel(child.cancel)
+        return child
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, ``None`` if there is no limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return self.cancelled.is_set() or \
+            (remaining is not None and remaining <= 0)
+
+    def timeout(self, default: Optional[float] = None) -> Optional[float]:
+        """Timeout for a blocking call: ``default`` capped by time left."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+    def check(self):
+        """Raise :class:`DeadlineExceeded` if expired or cancelled."""
+        if self.cancelled.is_set():
+            raise DeadlineExceeded("Cancelled.")
+        if self.expired:
+            raise DeadlineExceeded("Deadline exceeded.")
+
+    def sleep(self, seconds: float):
+        """Sleep, waking up early when cancelled or expired."""
+        self.cancelled.wait(self.timeout(seconds))
+        self.check()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Call ``callback`` when cancelled, right away if already so."""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        """Cancel the call, and run all registered callbacks."""
+        with self._lock:
+            if self.cancelled.is_set():
+                return
+            self.cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
@@ -0,0 +1,302 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from . import metrics
+from .deadline import Deadline, DeadlineExceeded
+from .engines import SpeechEngine, is_error
+from .health import EngineHealth
+from .quota import QuotaExceeded, RateLimiter
+
+
+class EngineUnavailable(RuntimeError):
+    """Raised when an engine is skipped because its circuit is open."""
+
+
+class EngineResult:
+    """Outcome of one speech engine on one voice clip."""
+
+    def __init__(self, engine: SpeechEngine,
+                 result: Optional[List[str]] = None,
+                 error: Optional[BaseException] = None,
+                 latency: float = 0.0):
+        self.engine = engine
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def failed(self) -> bool:
+        """If the engine raised an exception or returned ``ERROR!``."""
+        return self.error is not None or is_error(self.result)
+
+
+class Dispatcher:
+    """
+    Decide which speech engines a voice clip is sent to.
+
+    Policies:
+
+    * ``all``: Send to every engine, and wait for all of them.
+    * ``race``: Send to every engine, and return the first successful
+      result. Other calls are cancelled, closing their connections.
+    * ``cascade``: Try engines one by one in priority order, moving on
+      when one fails or takes longer than ``timeout`` seconds.
+    * ``hedged``: Like ``cascade``, but the next engine is started when
+      the current one is slower than its observed p90 latency, and the
+      first successful result wins.
+
+    With every policy but ``all``, failures are only reported if no
+    engine succeeds.
+
+    Each engine is tracked by an :class:`.EngineHealth`. Engines with an
+    open circuit are skipped, and so are engines that are rate limited
+    or near their quota. With ``routing: latency``, engines are
+    tried in the order of their health score instead of the configured
+    priority.
+    """
+
+    POLICY_ALL = "all"
+    POLICY_RACE = "race"
+    POLICY_CASCADE = "cascade"
+    POLICY_HEDGED = "hedged"
+    policies = (POLICY_ALL, POLICY_RACE, POLICY_CASCADE, POLICY_HEDGED)
+
+    ROUTING_PRIORITY = "priority"
+    ROUTING_LATENCY = "latency"
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.Dispatcher")
+
+    def __init__(self, policy: str = POLICY_ALL, timeout: float = 10,
+                 hedge_delay: float = 3, hedge_quantile: float = 0.9,
+                 samples: int = 100, routing: str = ROUTING_PRIORITY,
+                 health: Optional[Dict[str, Any]] = None,
+                 limiters: Optional[Dict[SpeechEngine, RateLimiter]] = None):
+        """
+        Arguments:
+            policy: Dispatch policy.
+            timeout: Seconds before ``cascade`` moves on to the next engine.
+            hedge_delay: Seconds before ``hedged`` starts the next engine,
+                until enough latencies are observed.
+            hedge_quantile: Quantile of observed latencies after which
+                ``hedged`` starts the next engine.
+            samples: Number of latencies kept per engine.
+            routing: ``priority`` or ``latency``.
+            health: Keyword arguments of :class:`.EngineHealth`.
+            limiters: Rate limiters of engines.
+        """
+        if policy not in self.policies:
+            raise ValueError(f"Unknown dispatch policy: {policy}")
+        if routing not in (self.ROUTING_PRIORITY, self.ROUTING_LATENCY):
+            raise ValueError(f"Unknown routing: {routing}")
+        self.routing = routing
+        self.health_options: Dict[str, Any] = health or dict()
+        self.health: Dict[SpeechEngine, EngineHealth] = dict()
+        self.limiters: Dict[SpeechEngine, RateLimiter] = limiters or dict()
+        self.policy = policy
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.samples = samples
+        self._latencies: Dict[SpeechEngine, Deque[float]] = dict()
+        self._lock = threading.Lock()
+
+    def health_of(self, engine: SpeechEngine) -> EngineHealth:
+        with self._lock:
+            if engine not in self.health:
+                self.health[engine] = EngineHealth(
+                    engine.engine_name, **self.health_options)
+            return self.health[engine]
+
+    def route(self, engines: List[SpeechEngine]) -> List[SpeechEngine]:
+        """Order engines to be tried."""
+        if self.routing == self.ROUTING_LATENCY:
+            return sorted(engines, key=lambda e: (
+                self.health_of(e).state != EngineHealth.CLOSED,
+                self.health_of(e).score))
+        return list(engines)
+
+    def record(self, engine: SpeechEngine, latency: float):
+        """Record latency of a successful call."""
+        with self._lock:
+            self._latencies.setdefault(
+                engine, deque(maxlen=self.samples)).append(latency)
+
+    def quantile(self, engine: SpeechEngine, q: float) -> Optional[float]:
+        """Observed latency quantile of an engine, ``None`` if too few."""
+        with self._lock:
+            data = sorted(self._latencies.get(engine, ()))
+        if len(data) < 10:
+            return None
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def _run(self, engine: SpeechEngine,
+             submit: Callable[[SpeechEngine, Deadline], Future],
+             deadline: Deadline) -> '_Call':
+        """Submit a call, and wrap its outcome in an :class:`EngineResult`."""
+        call = _Call(engine, deadline.child())
+        inner = submit(engine, call.deadline)
+        call.inner = inner
+
+        def done(f: Future):
+            latency = time.monotonic() - call.started
+            health = self.health_of(engine)
+            if f.cancelled():
+                health.release()
+                call.future.set_result(EngineResult(
+                    engine, error=DeadlineExceeded("Cancelled."),
+                    latency=latency))
+                return
+            exc = f.exception()
+            result = EngineResult(engine, f.result() if exc is None else None,
+                                  exc, latency)
+            if result.failed:
+                metrics.errors.inc(
+                    engine=engine.engine_name,
+                    type=type(exc).__name__ if exc else "ErrorResult")
+            if call.abandoned or isinstance(exc, QuotaExceeded):
+                # Not the engine's fault: cancelled because another
+                # engine won, or limited locally.
+                health.release()
+            else:
+                health.record(not result.failed, latency)
+            if not result.failed:
+                self.record(engine, latency)
+            call.future.set_result(result)
+
+        inner.add_done_callback(done)
+        return call
+
+    def dispatch(self, engines: List[SpeechEngine],
+                 submit: Callable[[SpeechEngine, Deadline], Future],
+                 deadline: Optional[Deadline] = None,
+                 policy: Optional[str] = None) \
+            -> Iterator[EngineResult]:
+        """
+        Send a clip to engines according to the policy.
+
+        Arguments:
+            engines: Engines in priority order.
+            submit: Start recognition with an engine, returning a future
+                of the result. The engine call should respect the
+                deadline given.
+            deadline: Deadline of the whole clip. When it expires, calls
+                still running are cancelled and reported as timed out.
+            policy: Policy of this clip, instead of :attr:`policy`.
+
+        Yields:
+            Results to be reported, as soon as each of them is known.
+        """
+        deadline = deadline or Deadline()
+        policy = policy or self.policy
+        queue = self.route(engines)
+        pending: Dict[Future, _Call] = dict()
+        failures: List[EngineResult] = []
+        skipped: List[SpeechEngine] = []
+        started = False
+        last: Optional[SpeechEngine] = None
+
+        def start_next():
+            nonlocal last, started
+            while queue:
+                engine = queue.pop(0)
+                limiter = self.limiters.get(engine)
+                if (limiter is not None and not limiter.available) or \
+                        not self.health_of(engine).allow():
+                    skipped.append(engine)
+                    continue
+                last = engine
+                call = self._run(engine, submit, deadline)
+                pending[call.future] = call
+                started = True
+                return
+
+        if policy in (self.POLICY_ALL, self.POLICY_RACE):
+            while queue:
+                start_next()
+        else:
+            start_next()
+
+        while pending:
+            timeout = None
+            if queue and policy == self.POLICY_CASCADE:
+                timeout = self.timeout
+            elif queue and policy == self.POLICY_HEDGED:
+                timeout = self.quantile(last, self.hedge_quantile)
+                if timeout is None:
+                    timeout = self.hedge_delay
+            if timeout is not None:
+                timeout = max(0, timeout - (time.monotonic() - max(
+                    c.started for c in pending.values())))
+            timeout = deadline.timeout(timeout)
+            done, _ = wait(pending, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for f in done:
+                del pending[f]
+                result: EngineResult = f.result()
+                if policy == self.POLICY_ALL:
+                    yield result
+                    continue
+                if not result.failed:
+                    for call in pending.values():
+                        call.abandoned = True
+                        call.cancel()
+                    yield result
+                    return
+                failures.append(result)
+            if not done and deadline.expired:
+                # Out of time, give up on all engines still running.
+                for call in pending.values():
+                    call.cancel()
+                    result = EngineResult(
+                        call.engine, error=DeadlineExceeded(
+                            "Deadline exceeded."),
+                        latency=time.monotonic() - call.started)
+                    if policy == self.POLICY_ALL:
+                        yield result
+                    else:
+                        failures.append(result)
+                pending.clear()
+                break
+            if not queue:
+                continue
+            if not done and policy == self.POLICY_CASCADE:
+                # Give up on the slow engine, and move on.
+                for call in pending.values():
+                    call.cancel()
+                    failures.append(EngineResult(
+                        call.engine, error=DeadlineExceeded(
+                            f"No response in {self.timeout} seconds."),
+                        latency=self.timeout))
+                pending.clear()
+            if not pending or not done:
+                start_next()
+
+        if not started:
+            for engine in skipped:
+                yield EngineResult(engine, error=EngineUnavailable(
+                    "Skipped, engine is unavailable."))
+        yield from failures
+
+
+class _Call:
+    """A call to a speech engine started by the :class:`Dispatcher`."""
+
+    def __init__(self, engine: SpeechEngine, deadline: Deadline):
+        self.engine = engine
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self.inner: Optional[Future] = None
+        self.future: Future = Future()
+        # Cancelled because another engine has succeeded
+        self.abandoned = False
+
+    def cancel(self):
+        """Cancel the call, whether it is queued or running."""
+        self.deadline.cancel()
+        if self.inner is not None:
+            self.inner.cancel()
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+from ehforwarderbot import Message
+
+
+class _PendingEdit:
+    def __init__(self):
+        self.message: Optional[Message] = None
+        self.timer: Optional[threading.Timer] = None
+        self.finished = False
+        self.lock = threading.Lock()
+
+
+class MessageEditor:
+    """
+    Send progressive edits of recognized messages.
+
+    Intermediate edits of a message are debounced, so results arriving
+    close together are merged into one edit, and edits to the same chat
+    are sent at most once every ``interval`` seconds. The final edit is
+    always sent, and no intermediate edit is sent after it.
+    """
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.MessageEditor")
+
+    def __init__(self, send: Callable[[Message], None],
+                 debounce: float = 0.5, interval: float = 2.0):
+        """
+        Arguments:
+            send: Function to send an edited message.
+            debounce: Seconds to wait for more results before an edit.
+            interval: Minimum seconds between edits in the same chat.
+        """
+        self.send = send
+        self.debounce = debounce
+        self.interval = interval
+        self._pending: Dict[Hashable, _PendingEdit] = dict()
+        self._last_edit: Dict[Hashable, float] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def chat_key(message: Message) -> Hashable:
+        return message.chat.module_id, message.chat.uid
+
+    def update(self, message: Message):
+        """Schedule an intermediate edit."""
+        key = (self.chat_key(message), message.uid)
+        with self._lock:
+            pending = self._pending.setdefault(key, _PendingEdit())
+            not_before = self._last_edit.get(self.chat_key(message), 0) + \
+                self.interval
+        with pending.lock:
+            if pending.finished:
+                return
+            pending.message = message
+            if pending.timer is None:
+                delay = max(self.debounce, not_before - time.monotonic())
+                pending.timer = threading.Timer(
+                    delay, self._flush, args=(key, pending))
+                pending.timer.daemon = True
+                pending.timer.start()
+
+    def finish(self, message: Message):
+        """Send the final edit of a message right away."""
+        key = (self.chat_key(message), message.uid)
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            with pending.lock:
+                pending.finished = True
+                if pending.timer is not None:
+                    pending.timer.cancel()
+        self._send(message)
+
+    def _flush(self, key: Hashable, pending: _PendingEdit):
+        with pending.lock:
+            if pending.finished:
+                return
+            message = pending.message
+            pending.timer = None
+            # Hold the lock while sending, so the final edit can't be
+            # overtaken by this one.
+            self._send(message)
+
+    def _send(self, message: Message):
+        now = time.monotonic()
+        with self._lock:
+            # Forget chats edited longer than an interval ago, which no
+            # longer delay edits, so the map does not grow forever.
+            stale = [k for k, t in self._last_edit.items()
+                     if now - t >= self.interval]
+            for key in stale:
+                del self._last_edit[key]
+            self._last_edit[self.chat_key(message)] = now
+        try:
+            self.send(message)
+        except Exception:
+            self.logger.exception("Failed to edit message %s.", message.uid)
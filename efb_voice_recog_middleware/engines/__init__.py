@@ -1,5 +1,38 @@
+import asyncio
+import importlib
 from abc import ABC, abstractmethod
-from typing import IO, List
+from typing import IO, Any, Callable, Dict, List, Optional, Type, TypeVar, \
+    TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..deadline import Deadline
+
+ENTRY_POINT_GROUP = "efb_voice_recog_middleware.engines"
+"""Entry point group for third-party speech engines"""
+
+builtin_engines: Dict[str, str] = {
+    "baidu": "efb_voice_recog_middleware.engines.baidu:BaiduSpeech",
+    "azure": "efb_voice_recog_middleware.engines.azure:AzureSpeech",
+    "iflytek": "efb_voice_recog_middleware.engines.iflytek:IFlyTekSpeech",
+    "tencent": "efb_voice_recog_middleware.engines.tencent:TencentSpeech",
+    "vosk": "efb_voice_recog_middleware.engines.vosk:VoskSpeech",
+}
+"""Built-in speech engines, as ``module:class`` keyed by config name"""
+
+builtin_async_engines: Dict[str, str] = {
+    "baidu": "efb_voice_recog_middleware.engines.aio.baidu:AsyncBaiduSpeech",
+    "azure": "efb_voice_recog_middleware.engines.aio.azure:AsyncAzureSpeech",
+    "iflytek":
+        "efb_voice_recog_middleware.engines.aio.iflytek:AsyncIFlyTekSpeech",
+}
+"""Built-in asyncio engines, used with ``async: true`` in their config"""
+
+_T = TypeVar("_T")
+
+
+def is_error(result: Optional[List[str]]) -> bool:
+    """If a result of :meth:`SpeechEngine.recognize` reports an error."""
+    return bool(result and result[0] == "ERROR!")
 
 
 class SpeechEngine(ABC):
@@ -7,7 +40,84 @@ class SpeechEngine(ABC):
     engine_name: str = __name__
     """List of languages codes supported"""
     lang_list: List[str] = []
+    """
+    Copies of the decoded PCM a call holds at its peak, besides the PCM
+    shared by all engines, e.g. a WAV or a request body
+    """
+    working_copies: float = 1
 
     @abstractmethod
-    def recognize(self, file: IO[bytes], lang: str):
+    def recognize(self, file: IO[bytes], lang: str,
+                  deadline: Optional['Deadline'] = None):
+        """
+        Recognize a voice clip.
+
+        ``deadline`` is optional for engines: it is only passed to
+        engines whose ``recognize`` accepts it.
+        """
         raise NotImplementedError()
+
+
+class AsyncSpeechEngine(SpeechEngine):
+    """
+    Speech engine with a coroutine ``recognize``.
+
+    It runs on the event loop of the middleware, so it must not block:
+    use :meth:`run_blocking` for blocking work like decoding audio.
+    """
+
+    @abstractmethod
+    async def recognize(self, file: IO[bytes], lang: str,
+                        deadline: Optional['Deadline'] = None):
+        raise NotImplementedError()
+
+    async def close(self):
+        """Close connections of the engine, in the event loop."""
+
+    @staticmethod
+    async def run_blocking(func: Callable[..., _T], *args: Any) -> _T:
+        """Run ``func(*args)`` in the default executor of the loop."""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, func, *args)
+
+
+def _entry_points(group: str):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            import pkg_resources
+            return pkg_resources.iter_entry_points(group)
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=group)
+    return eps.get(group, [])
+
+
+def load_engine(key: str, asynchronous: bool = False) \
+        -> Type[SpeechEngine]:
+    """
+    Import the speech engine class registered as ``key``.
+
+    Built-in engines are looked up first, then the entry points in group
+    ``efb_voice_recog_middleware.engines``. Only the module of the
+    requested engine is imported.
+
+    If ``asynchronous`` is set, the asyncio version of a built-in
+    engine is imported, when there is one.
+
+    Raises:
+        KeyError: if no engine is registered as ``key``.
+    """
+    if asynchronous and key in builtin_async_engines:
+        module, _, attr = builtin_async_engines[key].partition(":")
+        return getattr(importlib.import_module(module), attr)
+    if key in builtin_engines:
+        module, _, attr = builtin_engines[key].partition(":")
+        return getattr(importlib.import_module(module), attr)
+    for ep in _entry_points(ENTRY_POINT_GROUP):
+        if ep.name == key:
+            return ep.load()
+    raise KeyError(f"Speech engine {key} is not found.")
@@ -0,0 +1,73 @@
+"""
+Speech engines built on asyncio, with non-blocking HTTP and websocket
+clients from ``aiohttp``.
+
+Install with ``pip install efb-voice_recog-middleware[async]``, and
+enable with ``async: true`` in the config of an engine.
+"""
+import json
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from ...deadline import Deadline
+
+
+class AsyncHTTPSession:
+    """
+    Keep-alive HTTP session of an asyncio speech engine.
+
+    The :class:`aiohttp.ClientSession` is created on first use, in the
+    event loop of the middleware. Options read from the engine config
+    are the same as :class:`..http.HTTPSession`: ``pool_size``,
+    ``connect_timeout``, ``read_timeout`` and ``keep_alive``.
+    """
+
+    def __init__(self, keys: Dict[str, Any]):
+        self.pool_size: int = keys.get('pool_size', 2)
+        self.connect_timeout: float = keys.get('connect_timeout', 5)
+        self.read_timeout: float = keys.get('read_timeout', 30)
+        self.keep_alive: bool = keys.get('keep_alive', True)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    force_close=not self.keep_alive))
+        return self._session
+
+    def timeout(self, deadline: Optional[Deadline] = None) \
+            -> aiohttp.ClientTimeout:
+        """Timeouts, capped by the time left before ``deadline``."""
+        if deadline is None:
+            return aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                         sock_read=self.read_timeout)
+        deadline.check()
+        return aiohttp.ClientTimeout(
+            total=deadline.timeout(None),
+            sock_connect=deadline.timeout(self.connect_timeout),
+            sock_read=deadline.timeout(self.read_timeout))
+
+    async def post(self, url: str, deadline: Optional[Deadline] = None,
+                   **kwargs) -> Tuple[int, Any]:
+        """
+        Send a POST request.
+
+        Returns:
+            Status code, and the body parsed as JSON, or as text if it
+            is not JSON.
+        """
+        kwargs.setdefault('timeout', self.timeout(deadline))
+        async with self.session.post(url, **kwargs) as r:
+            text = await r.text()
+        try:
+            return r.status, json.loads(text)
+        except ValueError:
+            return r.status, text
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
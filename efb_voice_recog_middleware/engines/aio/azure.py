@@ -0,0 +1,113 @@
+import asyncio
+from typing import AsyncIterator, Dict, Optional, Union
+
+from . import AsyncHTTPSession
+from .. import AsyncSpeechEngine
+from ..azure import AzureSpeech
+from ... import metrics
+from ...audio import AudioData, AudioSource
+from ...deadline import Deadline
+
+
+class AsyncAzureSpeech(AzureSpeech, AsyncSpeechEngine):
+    """:class:`.AzureSpeech` on asyncio."""
+
+    def __init__(self, keys: Dict[str, str]):
+        super().__init__(keys)
+        self.aio = AsyncHTTPSession(keys)
+
+    async def close(self):
+        await self.aio.close()
+
+    async def post_stream(self, audio: AudioData,
+                          deadline: Optional[Deadline], **kwargs):
+        """
+        Upload the audio while it is encoded, as in
+        :meth:`.AzureSpeech.post_stream`.
+
+        Returns:
+            The response, and stderr of ffmpeg if it failed.
+        """
+        pcm = memoryview(await self.run_blocking(lambda: audio.pcm))
+        proc = await asyncio.create_subprocess_exec(
+            *self.encoder_command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+
+        async def feed():
+            try:
+                for i in range(0, len(pcm), 65536):
+                    proc.stdin.write(pcm[i:i + 65536])
+                    await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg is killed
+            finally:
+                proc.stdin.close()
+
+        async def body() -> AsyncIterator[bytes]:
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if not chunk:
+                    return
+                metrics.bytes_sent.inc(len(chunk), engine=self.engine_name)
+                yield chunk
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            response = await self.aio.post(self.endpoint, data=body(),
+                                           deadline=deadline, **kwargs)
+        except BaseException:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            raise
+        finally:
+            feeder.cancel()
+            error = await proc.stderr.read()
+            await proc.wait()
+        return response, error if proc.returncode else None
+
+    async def recognize(self, path: Union[AudioSource, AudioData],
+                        lang: str = "",
+                        deadline: Optional[Deadline] = None):
+        if not lang:
+            lang = self.lang
+        if not AudioData.supports(path):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
+        if lang not in self.lang_list:
+            lang = self.first(self.lang_list, lambda a: a.split(
+                '-')[0] == lang.split('-')[0])
+            if lang not in self.lang_list:
+                return ["ERROR!", "Invalid language."]
+
+        audio = AudioData.of(path)
+        header = {
+            "Ocp-Apim-Subscription-Key": self.key,
+            "Content-Type": "audio/ogg; codecs=opus"
+        }
+        d = {
+            "language": lang,
+            "format": "detailed",
+        }
+        if self.stream:
+            (status, rjson), error = await self.post_stream(
+                audio, deadline, params=d, headers=header)
+            if error is not None:
+                return ["ERROR!", error.decode(errors='replace')]
+        else:
+            # Encoding runs ffmpeg, keep it off the event loop.
+            data = await self.run_blocking(lambda: audio.ogg_opus)
+            metrics.bytes_sent.inc(len(data), engine=self.engine_name)
+            status, rjson = await self.aio.post(
+                self.endpoint, params=d, data=data, headers=header,
+                deadline=deadline)
+
+        if status == 200 and isinstance(rjson, dict):
+            return [i['Display'] for i in rjson['NBest']]
+        else:
+            return ["ERROR!", rjson]
@@ -0,0 +1,58 @@
+from typing import Optional
+
+from . import AsyncHTTPSession
+from .. import AsyncSpeechEngine
+from ..baidu import BaiduSpeech
+from ... import metrics
+from ...audio import AudioData
+from ...deadline import Deadline
+
+
+class AsyncBaiduSpeech(BaiduSpeech, AsyncSpeechEngine):
+    """
+    :class:`.BaiduSpeech` on asyncio.
+
+    The access token is still requested with the blocking client, in an
+    executor: it is only refreshed about once a month.
+    """
+
+    def __init__(self, key_dict):
+        super().__init__(key_dict)
+        self.aio = AsyncHTTPSession(key_dict)
+
+    async def close(self):
+        await self.aio.close()
+
+    async def recognize(self, file, lang="",
+                        deadline: Optional[Deadline] = None):
+        if not lang:
+            lang = self.lang
+        if not AudioData.supports(file):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
+        if lang.lower() not in self.lang_list:
+            return ["ERROR!", "Invalid language."]
+
+        audio = AudioData.of(file)
+        pcm = await self.run_blocking(lambda: audio.pcm)
+        token = await self.run_blocking(lambda: self.access_token)
+        headers = {
+            "Content-Type": "audio/pcm;rate=16000"
+        }
+        params = {
+            "cuid": "catbaron.voice_recog",
+            "token": token,
+            "dev_pid": self.languages[lang],
+        }
+        metrics.bytes_sent.inc(len(pcm), engine=self.engine_name)
+        status, rjson = await self.aio.post(
+            self.api_url, params=params, headers=headers, data=pcm,
+            deadline=deadline)
+        if status != 200 or not isinstance(rjson, dict):
+            return ["ERROR!", status, rjson]
+        if rjson['err_no'] == 0:
+            return rjson['result']
+        else:
+            return ["ERROR!", rjson['err_msg']]
@@ -0,0 +1,124 @@
+import asyncio
+from io import BytesIO
+from typing import Dict, Optional, Union
+
+import aiohttp
+from yarl import URL
+
+from . import AsyncHTTPSession
+from .. import AsyncSpeechEngine
+from ..iflytek import IFlyTekConnectionPool, IFlyTekSpeech, \
+    STATUS_LAST_FRAME
+from ... import metrics
+from ...audio import AudioData, AudioSource
+from ...deadline import Deadline
+
+
+class AsyncIFlyTekSpeech(IFlyTekSpeech, AsyncSpeechEngine):
+    """
+    :class:`.IFlyTekSpeech` on asyncio.
+
+    Connections are opened per session: they are cheap without a
+    thread each, so the connection pool of the blocking engine is not
+    used.
+    """
+
+    def __init__(self, keys: Dict[str, str]):
+        super().__init__(keys)
+        self.aio = AsyncHTTPSession(keys)
+
+    async def close(self):
+        await self.aio.close()
+
+    class AsyncIFlyTekSession(IFlyTekSpeech.IFlyTekSession):
+        """
+        A recognition session, reading messages from the server in its
+        own task while audio frames are sent.
+        """
+
+        def __init__(self, keys: Dict[str, str], file, lang,
+                     pool: IFlyTekConnectionPool,
+                     http: aiohttp.ClientSession,
+                     deadline: Optional[Deadline] = None):
+            super().__init__(keys, file, lang, pool, deadline)
+            self.http = http
+
+        async def run(self):
+            """
+            Run the session.
+
+            Raises:
+                DeadlineExceeded: if the deadline is exceeded.
+            """
+            try:
+                # Keep the signed query string as it is.
+                url = URL(self.pool.build_url(), encoded=True)
+                ws = await asyncio.wait_for(
+                    self.http.ws_connect(url, autoclose=True),
+                    self.deadline.timeout(self.pool.timeout))
+            except Exception as e:
+                self.deadline.check()
+                self.on_error(e)
+                return self.outcome()
+            reader = asyncio.ensure_future(self.read(ws))
+            try:
+                await self.send_file(ws, self.file, self.lang)
+                await asyncio.wait_for(
+                    asyncio.shield(reader),
+                    self.deadline.timeout(self.pool.timeout))
+            except asyncio.TimeoutError:
+                self.deadline.check()
+                self.on_error("Timed out")
+            except Exception as e:
+                self.deadline.check()
+                self.on_error(e)
+            finally:
+                reader.cancel()
+                await ws.close()
+            return self.outcome()
+
+        async def read(self, ws: aiohttp.ClientWebSocketResponse):
+            while not self.done.is_set():
+                msg = await ws.receive()
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self.on_message(msg.data)
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    self.on_error(ws.exception())
+                else:
+                    self.on_message(None)
+
+        async def send_file(self, ws: aiohttp.ClientWebSocketResponse,
+                            f, lang):
+            interval = 0.04
+            for status, frame in self.frames(f, lang):
+                self.deadline.check()
+                metrics.bytes_sent.inc(len(frame),
+                                       engine=IFlyTekSpeech.engine_name)
+                await ws.send_str(frame)
+                if status == STATUS_LAST_FRAME or self.done.is_set():
+                    break
+                if self.paced:
+                    await asyncio.sleep(interval)
+                else:
+                    # Let the reader handle messages already received.
+                    await asyncio.sleep(0)
+
+    async def recognize(self, path: Union[AudioSource, AudioData],
+                        lang: str = '', deadline: Optional[Deadline] = None):
+        if not lang:
+            lang = self.lang
+
+        if not AudioData.supports(path):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
+        if lang not in self.lang_list:
+            return ["ERROR!", "Invalid language."]
+
+        audio = AudioData.of(path)
+        pcm = await self.run_blocking(lambda: audio.pcm)
+        with BytesIO(pcm) as f:
+            return await self.AsyncIFlyTekSession(
+                self.keys, f, lang, self.pool, self.aio.session,
+                deadline).run()
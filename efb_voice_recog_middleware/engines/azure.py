@@ -1,11 +1,12 @@
-from typing import Dict, TypeVar, Callable, Optional, List
-from io import BytesIO
-from os import PathLike
-
-import pydub
-import requests
+from typing import Dict, Iterator, TypeVar, Callable, Optional, List, Union
+from threading import Thread
+import subprocess
 
 from . import SpeechEngine
+from .http import HTTPSession
+from .. import metrics
+from ..audio import AudioData, AudioSource
+from ..deadline import Deadline
 
 _T = TypeVar("_T")
 
@@ -45,6 +46,7 @@ class AzureSpeech(SpeechEngine):
         Arguments:
             keys {Dict[str, str]} -- authorization keys
             need 'key1' and 'endpoint'
+            optional 'stream': encode and upload at the same time
         """
         self.key = keys['key1']
         self.auth_endpoint = keys['endpoint']
@@ -54,41 +56,116 @@ class AzureSpeech(SpeechEngine):
             'conversation/cognitiveservices/v1'
         )
         self.lang = keys.get('lang', 'zh-CN')
+        self.stream: bool = keys.get('stream', False)
+        self.http = HTTPSession(keys)
+
+    @staticmethod
+    def encoder_command() -> List[str]:
+        """ffmpeg command encoding PCM on stdin to Ogg/Opus on stdout."""
+        import pydub
+        return [
+            pydub.AudioSegment.converter, "-loglevel", "error",
+            "-f", "s16le", "-ar", str(AudioData.sample_rate),
+            "-ac", str(AudioData.channels), "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", "16k", "-f", "ogg", "pipe:1"
+        ]
+
+    def post_stream(self, audio: AudioData, deadline: Optional[Deadline],
+                    **kwargs):
+        """
+        Upload the audio while it is encoded.
+
+        ffmpeg is fed PCM from a thread, and Ogg pages are sent with
+        chunked transfer encoding as soon as ffmpeg writes them, so the
+        upload starts before encoding ends.
 
-    def recognize(self, path: PathLike, lang: str = ""):
+        Returns:
+            The response, and stderr of ffmpeg if it failed.
+        """
+        pcm = memoryview(audio.pcm)
+        proc = subprocess.Popen(self.encoder_command(),
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        if deadline is not None:
+            deadline.on_cancel(proc.kill)
+
+        def feed():
+            try:
+                for i in range(0, len(pcm), 65536):
+                    proc.stdin.write(pcm[i:i + 65536])
+            except (BrokenPipeError, ValueError):
+                pass  # ffmpeg is killed
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        def body() -> Iterator[bytes]:
+            while True:
+                chunk = proc.stdout.read1(65536)
+                if not chunk:
+                    return
+                metrics.bytes_sent.inc(len(chunk), engine=self.engine_name)
+                yield chunk
+
+        Thread(target=feed, name="VoiceRecog Azure encoder",
+               daemon=True).start()
+        try:
+            r = self.http.post(self.endpoint, data=body(),
+                               deadline=deadline, **kwargs)
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            error = proc.stderr.read()
+            proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+        return r, error if proc.returncode else None
+
+    def recognize(self, path: Union[AudioSource, AudioData], lang: str = "",
+                  deadline: Optional[Deadline] = None):
         if not lang:
             lang = self.lang
-        if not isinstance(path, str):
-            return ["ERROR!", "File must be a path string."]
+        if not AudioData.supports(path):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
         if lang not in self.lang_list:
             lang = self.first(self.lang_list, lambda a: a.split(
                 '-')[0] == lang.split('-')[0])
             if lang not in self.lang_list:
                 return ["ERROR!", "Invalid language."]
 
-        with BytesIO() as f:
-            audio = pydub.AudioSegment.from_file(path)\
-                .set_frame_rate(16000)\
-                .set_channels(1)
-            audio.export(
-                f, format="ogg", codec="libopus", bitrate='16k')
-            header = {
-                "Ocp-Apim-Subscription-Key": self.key,
-                "Content-Type": "audio/ogg; codecs=opus"
-            }
-            d = {
-                "language": lang,
-                "format": "detailed",
-            }
-            f.seek(0)
-            r = requests.post(self.endpoint, params=d, data=f, headers=header)
+        audio = AudioData.of(path)
+        header = {
+            "Ocp-Apim-Subscription-Key": self.key,
+            "Content-Type": "audio/ogg; codecs=opus"
+        }
+        d = {
+            "language": lang,
+            "format": "detailed",
+        }
+        if self.stream:
+            r, error = self.post_stream(audio, deadline,
+                                        params=d, headers=header)
+            if error is not None:
+                return ["ERROR!", error.decode(errors='replace')]
+        else:
+            metrics.bytes_sent.inc(len(audio.ogg_opus),
+                                   engine=self.engine_name)
+            r = self.http.post(self.endpoint, params=d, data=audio.ogg_opus,
+                               headers=header, deadline=deadline)
 
-            try:
-                rjson = r.json()
-            except ValueError:
-                return ["ERROR!", r.text]
-
-            if r.status_code == 200:
-                return [i['Display'] for i in rjson['NBest']]
-            else:
-                return ["ERROR!", r.text]
+        try:
+            rjson = r.json()
+        except ValueError:
+            return ["ERROR!", r.text]
+
+        if r.status_code == 200:
+            return [i['Display'] for i in rjson['NBest']]
+        else:
+            return ["ERROR!", r.text]
@@ -1,16 +1,21 @@
-from typing import Dict
-from io import BytesIO
-
-import pydub
-import requests
+from typing import Any, Dict, Optional
+from pathlib import Path
+from threading import Lock, Timer
+import json
+import logging
+import os
+import time
 
 from . import SpeechEngine
+from .http import HTTPSession
+from .. import metrics
+from ..audio import AudioData
+from ..deadline import Deadline
 
 
 class BaiduSpeech(SpeechEngine):
     key_dict: Dict[str, str] = None
-    access_token: str = None
-    full_token = None
+    full_token: Optional[Dict[str, Any]] = None
     engine_name: str = "Baidu"
     lang_list = [
         'zh', 'en', 'zh-yue', 'zh-x-en',
@@ -26,52 +31,145 @@ class BaiduSpeech(SpeechEngine):
         "zh-x-farfield": 1936
     }
 
+    token_url: str = "https://openapi.baidu.com/oauth/2.0/token"
+    api_url: str = "http://vop.baidu.com/server_api"
+
+    # Seconds before retrying a failed background refresh, doubled on
+    # each failure up to the max
+    retry_delay: float = 30
+    max_retry_delay: float = 1800
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.BaiduSpeech")
+
     def __init__(self, key_dict: Dict[str, str]):
+        """
+        Endpoints can be overridden with ``token_url`` and ``api_url``.
+
+        No network request is made here. The access token is loaded from
+        ``baidu_token.json`` in ``data_path`` if it is given, or requested
+        on first use otherwise.
+        """
         self.key_dict = key_dict
         self.lang = key_dict.get('lang', 'zh')
+        self.token_url = key_dict.get('token_url', self.token_url)
+        self.api_url = key_dict.get('api_url', self.api_url)
+        self.http = HTTPSession(key_dict)
+        self.token_path: Optional[Path] = None
+        if key_dict.get('data_path'):
+            self.token_path = Path(key_dict['data_path']) / "baidu_token.json"
+        self._token_lock = Lock()
+        self._refresh_timer: Optional[Timer] = None
+        self.full_token = self.load_token()
+        if self.full_token is not None:
+            self.schedule_refresh()
+
+    def load_token(self) -> Optional[Dict[str, Any]]:
+        """Load the token saved on disk, if it is still valid."""
+        if self.token_path is None or not self.token_path.exists():
+            return None
+        try:
+            with self.token_path.open('r') as f:
+                token = json.load(f)
+        except ValueError:
+            return None
+        if token.get('client_id') != self.key_dict['api_key'] or \
+                token.get('expires_at', 0) <= time.time():
+            return None
+        return token
+
+    def refresh_token(self) -> Dict[str, Any]:
+        """Request a new access token, and save it to disk."""
         d = {
             "grant_type": "client_credentials",
-            "client_id": key_dict['api_key'],
-            "client_secret": key_dict['secret_key']
+            "client_id": self.key_dict['api_key'],
+            "client_secret": self.key_dict['secret_key']
         }
-        r = requests.post(
-            "https://openapi.baidu.com/oauth/2.0/token",
-            data=d
-        ).json()
-        self.access_token: str = r['access_token']
+        r = self.http.post(self.token_url, data=d).json()
+        if 'access_token' not in r:
+            raise RuntimeError(
+                f"Failed to get access token: {r.get('error_description')}")
+        r['expires_at'] = time.time() + r.get('expires_in', 0)
+        r['client_id'] = self.key_dict['api_key']
         self.full_token = r
+        if self.token_path is not None:
+            self.save_token(r)
+        self.schedule_refresh()
+        return r
 
-    def recognize(self, file, lang=""):
+    def save_token(self, token: Dict[str, Any]):
+        """Save the token to disk, readable only by the owner."""
+        fd = os.open(self.token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                     0o600)
+        # The mode is only applied to a new file.
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(token, f)
+
+    def schedule_refresh(self):
+        """Refresh the token in background before it expires."""
+        expires_at = self.full_token['expires_at']
+        lifetime = self.full_token.get('expires_in', 0)
+        # Refresh when 90% of the lifetime is spent, at least 1 min early
+        delay = expires_at - time.time() - max(lifetime * 0.1, 60)
+        self._start_refresh(delay, self.retry_delay)
+
+    def _start_refresh(self, delay: float, retry_delay: float):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        self._refresh_timer = Timer(max(delay, 0), self._background_refresh,
+                                    args=(retry_delay,))
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self, retry_delay: float):
+        try:
+            with self._token_lock:
+                self.refresh_token()
+        except Exception as e:
+            self.logger.warning(
+                "Failed to refresh access token, retrying in %d s: %r",
+                retry_delay, e)
+            self._start_refresh(
+                retry_delay, min(retry_delay * 2, self.max_retry_delay))
+
+    @property
+    def access_token(self) -> str:
+        """A valid access token, requested on first use."""
+        with self._token_lock:
+            if self.full_token is None or \
+                    self.full_token['expires_at'] <= time.time():
+                self.refresh_token()
+            return self.full_token['access_token']
+
+    def recognize(self, file, lang="", deadline: Optional[Deadline] = None):
         if not lang:
             lang = self.lang
-        if hasattr(file, 'read'):
-            pass
-        elif not isinstance(file, str):
+        if not AudioData.supports(file):
             return [
                 "ERROR!",
-                "File must be a path string or a file object in `rb` mode."
+                "File must be a path, bytes or a file object in `rb` mode."
             ]
         if lang.lower() not in self.lang_list:
             return ["ERROR!", "Invalid language."]
 
-        audio = pydub.AudioSegment.from_file(
-            file).set_frame_rate(16000).set_channels(1)
-        with BytesIO() as f:
-            audio.export(f, format="s16le", codec="pcm_s16le")
-            headers = {
-                "Content-Type": "audio/pcm;rate=16000"
-            }
-            params = {
-                "cuid": "catbaron.voice_recog",
-                "token": self.access_token,
-                "dev_pid": self.languages[lang],
-            }
-            r = requests.post("http://vop.baidu.com/server_api",
-                              params=params, headers=headers, data=f)
-            if r.status_code != 200:
-                return ["ERROR!", r.status_code, r.content]
-            rjson = r.json()
-            if rjson['err_no'] == 0:
-                return rjson['result']
-            else:
-                return ["ERROR!", rjson['err_msg']]
+        audio = AudioData.of(file)
+        headers = {
+            "Content-Type": "audio/pcm;rate=16000"
+        }
+        params = {
+            "cuid": "catbaron.voice_recog",
+            "token": self.access_token,
+            "dev_pid": self.languages[lang],
+        }
+        metrics.bytes_sent.inc(len(audio.pcm), engine=self.engine_name)
+        r = self.http.post(self.api_url,
+                           params=params, headers=headers, data=audio.pcm,
+                           deadline=deadline)
+        if r.status_code != 200:
+            return ["ERROR!", r.status_code, r.content]
+        rjson = r.json()
+        if rjson['err_no'] == 0:
+            return rjson['result']
+        else:
+            return ["ERROR!", rjson['err_msg']]
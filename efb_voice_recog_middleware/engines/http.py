@@ -0,0 +1,168 @@
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from ..deadline import Deadline
+
+# Request in flight in each thread
+_local = threading.local()
+
+
+class _Request:
+    """Connections used by a request, shut down when it is cancelled."""
+
+    def __init__(self):
+        self.connections: List[HTTPConnection] = []
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def abort(connection: HTTPConnection):
+        """Shut down the socket of a connection, waking up its reader."""
+        sock = connection.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def add(self, connection: HTTPConnection):
+        with self._lock:
+            if self.cancelled:
+                self.abort(connection)
+            self.connections.append(connection)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for connection in self.connections:
+                self.abort(connection)
+
+    def finish(self):
+        """Stop tracking the connections, back in the pool for reuse."""
+        with self._lock:
+            self.connections = []
+
+
+def _track(connection: HTTPConnection):
+    request: Optional[_Request] = getattr(_local, 'request', None)
+    if request is not None:
+        request.add(connection)
+
+
+class _HTTPConnection(HTTPConnection):
+    def connect(self):
+        super().connect()
+        # Possibly cancelled while connecting, before there was a socket.
+        _track(self)
+
+
+class _HTTPSConnection(HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _track(self)
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        _track(connection)
+        return connection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        _track(connection)
+        return connection
+
+
+class _CancellableAdapter(HTTPAdapter):
+    """Adapter whose connections can be shut down by another thread."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _HTTPConnectionPool,
+            'https': _HTTPSConnectionPool,
+        }
+
+
+class HTTPSession:
+    """
+    Thread-safe keep-alive HTTP session of a speech engine.
+
+    Every thread gets its own :class:`requests.Session`, while all of
+    them share one connection pool, so TCP and TLS connections are reused
+    across requests. A request whose deadline is cancelled has its
+    connection shut down, so it returns at once instead of waiting for
+    the server.
+
+    Options read from the engine config:
+
+    * ``pool_size``: Max number of connections kept alive (default: 2).
+    * ``connect_timeout``: Connect timeout in seconds (default: 5).
+    * ``read_timeout``: Read timeout in seconds (default: 30).
+    * ``keep_alive``: Reuse connections (default: ``true``).
+    """
+
+    def __init__(self, keys: Dict[str, Any]):
+        self.adapter = _CancellableAdapter(
+            pool_connections=4,
+            pool_maxsize=keys.get('pool_size', 2))
+        self.timeout = (keys.get('connect_timeout', 5),
+                        keys.get('read_timeout', 30))
+        self.keep_alive: bool = keys.get('keep_alive', True)
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+        return session
+
+    def post(self, url: str, deadline: Optional[Deadline] = None,
+             **kwargs) -> requests.Response:
+        """
+        Send a POST request.
+
+        If ``deadline`` is given, timeouts are capped by the time left,
+        the request is not sent once it is expired, and its connection
+        is closed when it is cancelled.
+        """
+        if deadline is None:
+            kwargs.setdefault('timeout', self.timeout)
+            return self.session.post(url, **kwargs)
+        deadline.check()
+        kwargs.setdefault('timeout', (
+            deadline.timeout(self.timeout[0]),
+            deadline.timeout(self.timeout[1])))
+        request = _local.request = _Request()
+        deadline.on_cancel(request.cancel)
+        try:
+            return self.session.post(url, **kwargs)
+        except requests.RequestException:
+            # Report the cancellation rather than a broken connection.
+            deadline.check()
+            raise
+        finally:
+            request.finish()
+            _local.request = None
+
+    def close(self):
+        self.adapter.close()
@@ -1,27 +1,175 @@
-from typing import Dict, Any
+from typing import Dict, Any, Deque, Iterator, List, Optional, Tuple, Union
+from collections import deque
 from io import BytesIO
-from os import PathLike
 from datetime import datetime
 import hmac
 import hashlib
 import base64
 from time import mktime
 from wsgiref.handlers import format_date_time
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
 import time
 import json
-from threading import Event, Thread
+import logging
+import select
+from threading import Condition, Event, Thread
 
-import pydub
 import websocket
 
 from . import SpeechEngine
+from .. import metrics
+from ..audio import AudioData, AudioSource
+from ..deadline import Deadline
 
 
 STATUS_FIRST_FRAME = 0  # 第一帧的标识
 STATUS_CONTINUE_FRAME = 1  # 中间帧标识
 STATUS_LAST_FRAME = 2  # 最后一帧的标识
 
+SEND_PACED = "paced"  # Send frames in real time
+SEND_BURST = "burst"  # Send frames as fast as the server accepts them
+SEND_ADAPTIVE = "adaptive"  # Pace until the server acknowledges, then burst
+
+
+class IFlyTekConnectionPool:
+    """
+    Pool of authenticated websocket connections opened in advance.
+
+    IFlyTek closes a connection after one recognition session, and
+    rejects connections idle for about 10 seconds or signed more than
+    5 minutes ago. So the pool keeps up to ``size`` fresh connections
+    open only while the engine is in use, and replaces each of them
+    after ``max_idle`` seconds.
+    """
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.IFlyTekConnectionPool")
+
+    def __init__(self, keys: Dict[str, Any]):
+        """
+        Arguments:
+            keys {Dict[str, Any]} -- config of the IFlyTek engine, with
+            optional "pool_size", "pool_max_idle", "pool_keep_warm",
+            "read_timeout" and "url"
+        """
+        self.url: str = keys.get('url', 'wss://ws-api.xfyun.cn/v2/iat')
+        self.api_secret = keys['api_secret']
+        self.api_key = keys['api_key']
+        self.size: int = keys.get('pool_size', 1)
+        # Seconds a connection is kept before it is replaced
+        self.max_idle: float = keys.get('pool_max_idle', 8)
+        # Seconds to keep connections warm after the last session
+        self.keep_warm: float = keys.get('pool_keep_warm', 60)
+        self.timeout: float = keys.get('read_timeout', 30)
+        self._idle: Deque[Tuple[float, websocket.WebSocket]] = deque()
+        self._cond = Condition()
+        self._last_used = 0.0
+        self._thread: Optional[Thread] = None
+
+    def connect(self) -> websocket.WebSocket:
+        """Open a new authenticated connection."""
+        return websocket.create_connection(
+            self.build_url(), timeout=self.timeout)
+
+    def acquire(self) -> websocket.WebSocket:
+        """Take a connection from the pool, or open one if it is empty."""
+        ws = None
+        with self._cond:
+            self._last_used = time.monotonic()
+            while self._idle:
+                created, ws = self._idle.popleft()
+                if time.monotonic() - created < self.max_idle:
+                    break
+                self._close(ws)
+                ws = None
+            if self.size > 0 and self._thread is None:
+                self._thread = Thread(
+                    target=self._maintain,
+                    name="IFlyTek connection pool", daemon=True)
+                self._thread.start()
+            # Open a replacement for the connection taken.
+            self._cond.notify_all()
+        if ws is None:
+            ws = self.connect()
+        return ws
+
+    def _maintain(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                while self._idle and \
+                        now - self._idle[0][0] >= self.max_idle:
+                    self._close(self._idle.popleft()[1])
+                warm = now - self._last_used < self.keep_warm
+                if not warm or len(self._idle) >= self.size:
+                    if self._idle:
+                        timeout = self.max_idle - (now - self._idle[0][0])
+                    elif warm:
+                        timeout = self.keep_warm
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+                    continue
+            try:
+                ws = self.connect()
+            except Exception as e:
+                self.logger.warning("Failed to open connection: %r", e)
+                time.sleep(1)
+                continue
+            with self._cond:
+                self._idle.append((time.monotonic(), ws))
+
+    @staticmethod
+    def _close(ws: websocket.WebSocket):
+        try:
+            ws.close()
+        except Exception:
+            pass
+
+    def build_url(self):
+        """Create URL to websocket entrypoint with signature"""
+        parsed = urlparse(self.url)
+        # 生成RFC1123格式的时间戳
+        now = datetime.now()
+        date = format_date_time(mktime(now.timetuple()))
+
+        # 拼接字符串
+        signature_origin = (
+            f"host: {parsed.netloc}\n"
+            f"date: {date}\n"
+            f"GET {parsed.path} HTTP/1.1"
+        )
+
+        # 进行hmac-sha256进行加密
+        signature_sha = hmac.new(
+            self.api_secret.encode('utf-8'), 
+            signature_origin.encode('utf-8'),
+            digestmod=hashlib.sha256).digest()
+        signature_sha = base64.b64encode(
+            signature_sha).decode(encoding='utf-8')
+
+        authorization_origin = (
+            f'api_key="{self.api_key}", '
+            'algorithm="hmac-sha256", '
+            'headers="host date request-line", '
+            f'signature="{signature_sha}"'
+        )
+        authorization = base64.b64encode(
+            authorization_origin.encode('utf-8')).decode(encoding='utf-8')
+        # 将请求的鉴权参数组合为字典
+        v = {
+            "authorization": authorization,
+            "date": date,
+            "host": parsed.netloc
+        }
+        # 拼接鉴权参数，生成url
+        url = self.url + '?' + urlencode(v)
+        # print("date: ",date)
+        # print("v: ",v)
+        # 此处打印出建立连接时候的url,参考本demo的时候可取消上方打印的注释，比对相同参数时生成的url与自己代码生成的url是否一致
+        # print('websocket url :', url)
+        return url
+
 
 class IFlyTekSpeech(SpeechEngine):
     keys = None
@@ -34,9 +182,14 @@ class IFlyTekSpeech(SpeechEngine):
         Arguments:
             keys {Dict[str, str]} -- authorization keys
             requires "app_id", "api_secret", "api_key"
+            optional "send_mode": "paced", "burst" or "adaptive"
         """
+        if keys.get('send_mode', SEND_ADAPTIVE) not in \
+                (SEND_PACED, SEND_BURST, SEND_ADAPTIVE):
+            raise ValueError(f"Unknown send mode: {keys['send_mode']}")
         self.keys = keys
         self.lang = keys.get('lang', 'zh_cn')
+        self.pool = IFlyTekConnectionPool(keys)
 
     class IFlyTekSession:
 
@@ -45,83 +198,72 @@ class IFlyTekSpeech(SpeechEngine):
             "en": "en_us"
         }
 
-        def __init__(self, keys: Dict[str, str], file, lang):
+        def __init__(self, keys: Dict[str, str], file, lang,
+                     pool: IFlyTekConnectionPool,
+                     deadline: Optional[Deadline] = None):
             self.app_id = keys['app_id']
-            self.api_secret = keys['api_secret']
-            self.api_key = keys['api_key']
             self.common_args = {"app_id": self.app_id}
+            self.send_mode = keys.get('send_mode', SEND_ADAPTIVE)
             self.done = Event()
+            # Set when the server acknowledges audio without error
+            self.acked = Event()
             self.result = ""
+            # First error of the session, if any
+            self.error: Optional[str] = None
 
             self.file = file
             self.lang = lang
 
-            self.is_running = Event()
-            self.ws = websocket.WebSocketApp(
-                self.build_url(),
-                on_open=self.on_start,
-                on_message=self.on_message,
-                on_error=self.on_error)
+            self.pool = pool
+            self.deadline = deadline or Deadline()
+            self.ws: Optional[websocket.WebSocket] = None
 
         def run(self):
-            Thread(
-                target=self.ws.run_forever,
-                name="iflytek speech websocket listener thread"
-            ).start()
-
-            self.is_running.wait()
-
-            self.send_file(self.file, self.lang)
-
-            self.done.wait()
-
-            self.ws.close()
-
-            return self.result
-
-        def build_url(self):
-            """Create URL to websocket entrypoint with signature"""
-            url = 'wss://ws-api.xfyun.cn/v2/iat'
-            # 生成RFC1123格式的时间戳
-            now = datetime.now()
-            date = format_date_time(mktime(now.timetuple()))
-
-            # 拼接字符串
-            signature_origin = (
-                "host: ws-api.xfyun.cn\n"
-                f"date: {date}\n"
-                "GET /v2/iat HTTP/1.1"
-            )
-
-            # 进行hmac-sha256进行加密
-            signature_sha = hmac.new(
-                self.api_secret.encode('utf-8'), 
-                signature_origin.encode('utf-8'),
-                digestmod=hashlib.sha256).digest()
-            signature_sha = base64.b64encode(
-                signature_sha).decode(encoding='utf-8')
-
-            authorization_origin = (
-                f'api_key="{self.api_key}", '
-                'algorithm="hmac-sha256", '
-                'headers="host date request-line", '
-                f'signature="{signature_sha}"'
-            )
-            authorization = base64.b64encode(
-                authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-            # 将请求的鉴权参数组合为字典
-            v = {
-                "authorization": authorization,
-                "date": date,
-                "host": "ws-api.xfyun.cn"
-            }
-            # 拼接鉴权参数，生成url
-            url = url + '?' + urlencode(v)
-            # print("date: ",date)
-            # print("v: ",v)
-            # 此处打印出建立连接时候的url,参考本demo的时候可取消上方打印的注释，比对相同参数时生成的url与自己代码生成的url是否一致
-            # print('websocket url :', url)
-            return url
+            """
+            Run the session in the calling thread.
+
+            Messages from the server are read between audio frames and
+            after the last frame, so no listener thread is needed.
+
+            Raises:
+                DeadlineExceeded: if the deadline is exceeded or cancelled.
+                    The connection is closed right away in this case.
+            """
+            try:
+                self.deadline.check()
+                self.ws = self.pool.acquire()
+                self.deadline.on_cancel(self.ws.shutdown)
+                self.send_file(self.file, self.lang)
+                while not self.done.is_set():
+                    self.ws.settimeout(
+                        self.deadline.timeout(self.pool.timeout))
+                    self.on_message(self.ws.recv())
+            except Exception as e:
+                self.deadline.check()
+                self.on_error(e)
+            finally:
+                if self.ws is not None:
+                    self.ws.close()
+
+            return self.outcome()
+
+        def outcome(self) -> List[str]:
+            """Result of the session, or ``ERROR!`` if it has failed."""
+            if self.error is not None:
+                return ["ERROR!", self.error]
+            return [self.result]
+
+        def poll(self):
+            """Handle messages already received, without blocking."""
+            sock = self.ws.sock
+            while not self.done.is_set() and sock is not None and (
+                    getattr(sock, 'pending', lambda: 0)() or
+                    select.select([sock], [], [], 0)[0]):
+                self.on_message(self.ws.recv())
+
+        def send(self, data: str):
+            metrics.bytes_sent.inc(len(data), engine=IFlyTekSpeech.engine_name)
+            self.ws.send(data)
 
         def get_business_args(self, lang: str) -> Dict[str, Any]:
             lang = self.languages.get(lang, lang)
@@ -135,69 +277,73 @@ class IFlyTekSpeech(SpeechEngine):
             else:
                 return {"domain": "iat", "language": lang, "vad_eos": 10000}
 
-        def send_file(self, f, lang):
+        def frames(self, f, lang) -> Iterator[Tuple[int, str]]:
+            """Audio of ``f`` as JSON frames, with the status of each."""
             frame_size = 8000  # 每一帧的音频大小
-            interval = 0.04  # 发送音频间隔(单位:s)
             status = STATUS_FIRST_FRAME  # 音频的状态信息，标识音频是第一帧，还是中间帧、最后一帧
 
             biz_args = self.get_business_args(lang)
+            # Frames are read into the same buffer, and encoded from it.
+            buf = memoryview(bytearray(frame_size))
 
             while True:
-                buf = f.read(frame_size)
+                n = f.readinto(buf)
                 # 文件结束
-                if not buf:
+                if not n:
                     status = STATUS_LAST_FRAME
+                d: Dict[str, Any] = {
+                    "data": {
+                        "status": status, "format": "audio/L16;rate=16000",
+                        "audio": base64.b64encode(buf[:n]).decode(),
+                        "encoding": "raw"
+                    }
+                }
                 # 第一帧处理
                 # 发送第一帧音频，带business 参数
                 # appid 必须带上，只需第一帧发送
                 if status == STATUS_FIRST_FRAME:
-                    d = {
-                            "common": self.common_args,
-                            "business": biz_args,
-                            "data": {
-                                "status": 0, "format": "audio/L16;rate=16000",
-                                "audio": base64.b64encode(buf).decode(),
-                                "encoding": "raw"
-                            }
-                        }
-                    d = json.dumps(d)
-                    self.ws.send(d)
-                    status = STATUS_CONTINUE_FRAME
-                # 中间帧处理
-                elif status == STATUS_CONTINUE_FRAME:
-                    d = {
-                            "data": {
-                                "status": 1, "format": "audio/L16;rate=16000",
-                                "audio": base64.b64encode(buf).decode(),
-                                "encoding": "raw"
-                            }
-                        }
-                    self.ws.send(json.dumps(d))
+                    d["common"] = self.common_args
+                    d["business"] = biz_args
+                yield status, json.dumps(d)
                 # 最后一帧处理
-                elif status == STATUS_LAST_FRAME:
-                    d = {
-                            "data": {
-                                "status": 2, "format": "audio/L16;rate=16000",
-                                "audio": base64.b64encode(buf).decode(),
-                                "encoding": "raw"
-                            }
-                        }
-                    self.ws.send(json.dumps(d))
+                if status == STATUS_LAST_FRAME:
+                    return
+                # 中间帧处理
+                status = STATUS_CONTINUE_FRAME
+
+        @property
+        def paced(self) -> bool:
+            """If the next frame should wait for the sampling interval."""
+            return self.send_mode == SEND_PACED or (
+                self.send_mode == SEND_ADAPTIVE and not self.acked.is_set())
+
+        def send_file(self, f, lang):
+            interval = 0.04  # 发送音频间隔(单位:s)
+
+            for status, frame in self.frames(f, lang):
+                self.deadline.check()
+                self.send(frame)
+                if status == STATUS_LAST_FRAME:
+                    break
+                self.poll()
+                if self.done.is_set():
+                    # Server has reported an error, stop sending.
                     break
                 # 模拟音频采样间隔
-                time.sleep(interval)
-
-        def on_start(self, wsapp):
-            self.is_running.set()
+                if self.paced:
+                    self.deadline.sleep(interval)
 
-        def on_message(self, wsapp, message):
+        def on_message(self, message):
+            if not message:
+                self.on_error("connection closed")
+                return
             data = json.loads(message)
             code = data.get('code', -1)
             if code != 0:
-                self.result += f"[Error: {data['message']}, {code}]"
-                self.done.set()
+                self.on_error(f"{data['message']}, {code}")
                 return
 
+            self.acked.set()
             self.result += ''.join(
                 i['cw'][0]['w'] for i in data['data']['result']['ws']
                 if i.get('cw')
@@ -205,24 +351,24 @@ class IFlyTekSpeech(SpeechEngine):
             if data['data']['status'] == 2:
                 self.done.set()
 
-        def on_error(self, wsapp, error):
-            self.result += f"[Error: {error}]"
+        def on_error(self, error):
+            if self.error is None:
+                self.error = str(error) or repr(error)
+            self.done.set()
 
-    def recognize(self, path: PathLike, lang: str = ''):
+    def recognize(self, path: Union[AudioSource, AudioData], lang: str = '',
+                  deadline: Optional[Deadline] = None):
         if not lang:
             lang = self.lang
 
-        if not isinstance(path, str):
-            return ["ERROR!", "File must be a path string."]
+        if not AudioData.supports(path):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
         if lang not in self.lang_list:
             return ["ERROR!", "Invalid language."]
 
-        with BytesIO() as f:
-            audio = pydub.AudioSegment.from_file(path)\
-                .set_frame_rate(16000)\
-                .set_channels(1)
-            audio.export(f, format="s16le", codec="pcm_s16le", bitrate='16k')
-
-            f.seek(0)
-
-            return [self.IFlyTekSession(self.keys, f, lang).run()]
+        with BytesIO(AudioData.of(path).pcm) as f:
+            return self.IFlyTekSession(
+                self.keys, f, lang, self.pool, deadline).run()
@@ -1,17 +1,16 @@
-from typing import Dict
-from io import BytesIO
-from os import PathLike
+from typing import Dict, Optional, Union
 
-import pydub
 from tencentcloud.common import credential
 from tencentcloud.common.profile.client_profile import ClientProfile
 from tencentcloud.common.profile.http_profile import HttpProfile
 from tencentcloud.common.exception.tencent_cloud_sdk_exception import \
     TencentCloudSDKException
 from tencentcloud.asr.v20190614 import asr_client, models
-import base64
 
 from . import SpeechEngine
+from .. import metrics
+from ..audio import AudioData, AudioSource
+from ..deadline import Deadline
 
 
 class TencentSpeech(SpeechEngine):
@@ -19,6 +18,9 @@ class TencentSpeech(SpeechEngine):
     access_token = None
     engine_name = "Tencent"
     lang_list = ["zh", "en", "ca"]
+    # The base64 text, and the SDK's JSON request and its encoded body,
+    # each 4/3 the size of the PCM.
+    working_copies = 4
     languages = {
         "zh": "16k",
         "en": "16k_en",
@@ -34,43 +36,40 @@ class TencentSpeech(SpeechEngine):
         cred = credential.Credential(keys['secret_id'], keys['secret_key'])
         httpProfile = HttpProfile()
         httpProfile.endpoint = "asr.tencentcloudapi.com"
+        httpProfile.reqTimeout = keys.get('read_timeout', 60)
         clientProfile = ClientProfile()
         clientProfile.httpProfile = httpProfile
         clientProfile.signMethod = "TC3-HMAC-SHA256"
         self.client = asr_client.AsrClient(cred, "ap-shanghai", clientProfile)
         self.lang = keys.get('lang', 'zh')
 
-    def recognize(self, path: PathLike, lang: str = ""):
+    def recognize(self, path: Union[AudioSource, AudioData], lang: str = "",
+                  deadline: Optional[Deadline] = None):
         if not lang:
             lang = self.lang
-        if not isinstance(path, str):
-            return ["ERROR!", "File must be a path string."]
+        if not AudioData.supports(path):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
         if lang not in self.lang_list:
             return ["ERROR!", "Invalid language."]
 
         try:
-            with BytesIO() as f:
-                f.seek(0)
-                audio = pydub.AudioSegment.from_file(path)\
-                    .set_frame_rate(16000)\
-                    .set_channels(1)
-                audio.export(f, format="wav", codec="s16le", bitrate='16k')
+            audio = AudioData.of(path)
+            data_len = len(audio.wav_header) + len(audio.pcm)
+            # Encoded from the PCM in slices, without building the WAV.
+            base64_wav = audio.wav_base64()
+            metrics.bytes_sent.inc(len(base64_wav), engine=self.engine_name)
 
-                # f.seek(0)
-
-                # import pdb; pdb.set_trace()
-
-                data = f.getvalue()
-                data_len = len(data)
-                # print(data_len)
-                base64_wav = base64.b64encode(data).decode()
-
-                req = models.SentenceRecognitionRequest()
-                params = {"ProjectId": 0, "SubServiceType": 2, "EngSerViceType": self.languages[lang], "SourceType": 1, "Url": "",
-                          "VoiceFormat": "wav", "UsrAudioKey": "catbaron.voice_recog", "Data": base64_wav, "DataLen": data_len}
-                req._deserialize(params)
-                resp = self.client.SentenceRecognition(req)
-                # print(resp.to_json_string())
-                return [resp.Result]
+            req = models.SentenceRecognitionRequest()
+            params = {"ProjectId": 0, "SubServiceType": 2, "EngSerViceType": self.languages[lang], "SourceType": 1, "Url": "",
+                      "VoiceFormat": "wav", "UsrAudioKey": "catbaron.voice_recog", "Data": base64_wav, "DataLen": data_len}
+            req._deserialize(params)
+            if deadline is not None:
+                # The SDK can't be interrupted, so only check before sending.
+                deadline.check()
+            resp = self.client.SentenceRecognition(req)
+            return [resp.Result]
         except TencentCloudSDKException as err:
             return ["ERROR!", str(err)]
@@ -0,0 +1,123 @@
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Union
+
+import vosk
+
+from . import SpeechEngine
+from ..audio import AudioData, AudioSource
+from ..deadline import Deadline
+
+# Model loaded by each worker process
+_model: Optional['vosk.Model'] = None
+
+
+def _init_worker(model_path: str):
+    global _model
+    vosk.SetLogLevel(-1)
+    _model = vosk.Model(model_path)
+
+
+def _warm_up() -> bool:
+    return _model is not None
+
+
+def _recognize(pcm: bytes, rate: int) -> str:
+    """Recognize raw PCM with the model of this worker."""
+    recognizer = vosk.KaldiRecognizer(_model, rate)
+    view = memoryview(pcm)
+    for i in range(0, len(view), 65536):
+        recognizer.AcceptWaveform(bytes(view[i:i + 65536]))
+    return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class VoskSpeech(SpeechEngine):
+    """
+    Offline speech recognition with a local
+    `Vosk <https://alphacephei.com/vosk/>`_ model.
+
+    Recognition runs in a pool of worker processes, so it neither holds
+    the GIL of EFB nor blocks its threads. Each worker loads the model
+    once when it starts, and keeps it in memory; the workers are
+    started with the engine.
+    """
+    engine_name = "Vosk"
+
+    def __init__(self, keys: Dict[str, Any]):
+        """
+        Arguments:
+            keys {Dict[str, Any]} -- configuration
+            requires 'model': path to an unpacked Vosk model
+            optional 'lang': language of the model, only as a label
+            optional 'processes': number of worker processes
+        """
+        self.model: str = os.path.expanduser(keys['model'])
+        self.lang: str = keys.get('lang', 'zh')
+        # The language is decided by the model.
+        self.lang_list = [self.lang]
+        self.processes: int = max(1, keys.get('processes', 1))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+        self.warm_up()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Forking a process with running threads is unsafe.
+                self._pool = ProcessPoolExecutor(
+                    self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=(self.model,))
+            return self._pool
+
+    def warm_up(self):
+        """Start all workers, so the model is loaded before use."""
+        pool = self.pool
+        for _ in range(self.processes):
+            pool.submit(_warm_up)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def recognize(self, path: Union[AudioSource, AudioData], lang: str = "",
+                  deadline: Optional[Deadline] = None):
+        if not lang:
+            lang = self.lang
+        if not AudioData.supports(path):
+            return [
+                "ERROR!",
+                "File must be a path, bytes or a file object in `rb` mode."
+            ]
+        if lang not in self.lang_list:
+            return ["ERROR!", "Invalid language."]
+
+        audio = AudioData.of(path)
+        pcm = audio.pcm
+        try:
+            future = self.pool.submit(_recognize, pcm, audio.sample_rate)
+            if deadline is not None:
+                finished = threading.Event()
+                future.add_done_callback(lambda _: finished.set())
+                deadline.on_cancel(finished.set)
+                finished.wait(deadline.timeout(None))
+                if not future.done():
+                    # Expired or cancelled: a queued job is dropped, and
+                    # a running one is left to finish in its worker.
+                    future.cancel()
+                    deadline.check()
+            return [future.result()]
+        except BrokenProcessPool as e:
+            # A worker died, e.g. killed for memory; start a new pool.
+            with self._lock:
+                self._pool = None
+            return ["ERROR!", repr(e)]
@@ -0,0 +1,112 @@
+import logging
+import threading
+from typing import Optional
+
+
+class EngineHealth:
+    """
+    Health tracker and circuit breaker of a speech engine.
+
+    Latency and error rate are tracked as exponentially weighted moving
+    averages. The circuit opens when the error rate passes
+    ``error_threshold``, and the engine is skipped. After ``cooldown``
+    seconds a background timer half-opens the circuit, letting one call
+    through as a probe: the circuit closes if it succeeds, or opens again
+    otherwise.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.EngineHealth")
+
+    def __init__(self, name: str, alpha: float = 0.2,
+                 error_threshold: float = 0.5, min_calls: int = 5,
+                 cooldown: float = 60):
+        """
+        Arguments:
+            name: Name of the engine, for logging.
+            alpha: Weight of the latest call in moving averages.
+            error_threshold: Error rate above which the circuit opens.
+            min_calls: Calls needed before the circuit can open.
+            cooldown: Seconds before an open circuit is half-opened.
+        """
+        self.name = name
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self._probing = False
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """If a call may be sent to the engine now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, success: bool, latency: float):
+        """Record the outcome of a call."""
+        with self._lock:
+            self.calls += 1
+            self.error_rate += self.alpha * ((not success) - self.error_rate)
+            if success:
+                self.latency = latency if self.latency is None else \
+                    self.latency + self.alpha * (latency - self.latency)
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if success:
+                    self.logger.info("%s recovered, circuit closed.",
+                                     self.name)
+                    self.state = self.CLOSED
+                    self.error_rate = 0.0
+                else:
+                    self._open()
+            elif self.state == self.CLOSED and \
+                    self.calls >= self.min_calls and \
+                    self.error_rate > self.error_threshold:
+                self.logger.warning(
+                    "%s error rate is %.0f%%, circuit opened.",
+                    self.name, self.error_rate * 100)
+                self._open()
+
+    def release(self):
+        """Give up a probe without an outcome, e.g. when it is cancelled."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self):
+        """Open the circuit. Lock must be held."""
+        self.state = self.OPEN
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.cooldown, self._half_open)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _half_open(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                self.state = self.HALF_OPEN
+                self._probing = False
+
+    @property
+    def score(self) -> float:
+        """
+        Expected cost of a call, lower is better: latency inflated
+        by error rate. Engines never called score 0 to get explored.
+        """
+        if self.latency is None:
+            return 0.0 if self.calls == 0 else float('inf')
+        return self.latency / max(1 - self.error_rate, 0.05)
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Optional
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in a background thread.
+
+    Coroutines are submitted from other threads, and their results are
+    returned as :class:`concurrent.futures.Future`. Cancelling such a
+    future cancels the coroutine in the loop.
+    """
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.EventLoopThread")
+
+    def __init__(self, name: str = "VoiceRecog event loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread: Optional[threading.Thread] = threading.Thread(
+            target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro: Awaitable[Any]) -> Future:
+        """Run a coroutine in the loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout: Optional[float] = 5):
+        """Cancel all tasks and stop the loop."""
+        if self._thread is None:
+            return
+
+        async def cancel_all():
+            tasks = [t for t in asyncio.all_tasks()
+                     if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.loop.shutdown_asyncgens()
+
+        try:
+            self.submit(cancel_all()).result(timeout)
+        except Exception as e:
+            self.logger.warning("Failed to cancel tasks: %r", e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
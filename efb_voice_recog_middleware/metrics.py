@@ -0,0 +1,263 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: LabelValues, extra: str = "") -> str:
+    items = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind: str = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(labels: Dict[str, str]) -> LabelValues:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[LabelValues, float] = dict()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(labels)} {value}"
+
+
+class Gauge(Metric):
+    """A gauge whose value is read from a function when rendered."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def samples(self) -> Iterator[str]:
+        if self.function is not None:
+            yield f"{self.name} {self.function()}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    default_buckets: Sequence[float] = (
+        .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str,
+                 buckets: Sequence[float] = default_buckets):
+        super().__init__(name, documentation)
+        self.buckets: List[float] = sorted(buckets)
+        # labels -> ([count per bucket, ..., +Inf], sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = dict()
+
+    def observe(self, value: float, **labels: str):
+        key = self.key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = counts, total + value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the time spent in a ``with`` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [(k, list(c), t) for k, (c, t) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = 'le="%s"' % le
+                yield (f"{self.name}_bucket"
+                       f"{_labels(labels, le_label)} {cumulative}")
+            yield f"{self.name}_sum{_labels(labels)} {total}"
+            yield f"{self.name}_count{_labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Collection of metrics, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+copy_seconds: Histogram = registry.register(Histogram(
+    "voice_recog_copy_seconds",
+    "Time spent taking over the voice file of a message."))
+decode_seconds: Histogram = registry.register(Histogram(
+    "voice_recog_decode_seconds",
+    "Time spent decoding a voice clip to PCM."))
+encode_seconds: Histogram = registry.register(Histogram(
+    "voice_recog_encode_seconds",
+    "Time spent encoding PCM for an engine, by format."))
+queue_wait_seconds: Histogram = registry.register(Histogram(
+    "voice_recog_queue_wait_seconds",
+    "Time a voice message waits in the queue."))
+engine_seconds: Histogram = registry.register(Histogram(
+    "voice_recog_engine_seconds",
+    "Time spent in a speech engine call, including upload and network."))
+end_to_end_seconds: Histogram = registry.register(Histogram(
+    "voice_recog_end_to_end_seconds",
+    "Time from receiving a voice message to the final edit."))
+bytes_sent: Counter = registry.register(Counter(
+    "voice_recog_bytes_sent_total",
+    "Bytes of audio sent to a speech engine."))
+errors: Counter = registry.register(Counter(
+    "voice_recog_errors_total",
+    "Failed speech engine calls, by engine and error type."))
+cache_hits: Counter = registry.register(Counter(
+    "voice_recog_cache_hits_total",
+    "Recognition results served from the cache."))
+cache_misses: Counter = registry.register(Counter(
+    "voice_recog_cache_misses_total",
+    "Recognition results not found in the cache."))
+queue_depth: Gauge = registry.register(Gauge(
+    "voice_recog_queue_depth",
+    "Voice messages waiting in the queue."))
+shed: Counter = registry.register(Counter(
+    "voice_recog_shed_total",
+    "Voice messages degraded or skipped while overloaded, by action."))
+shedding: Gauge = registry.register(Gauge(
+    "voice_recog_shedding",
+    "1 while load is shed, 0 otherwise."))
+memory_in_use_bytes: Gauge = registry.register(Gauge(
+    "voice_recog_memory_in_use_bytes",
+    "Estimated memory of the voice messages being recognized."))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsExporter:
+    """
+    Expose metrics of a registry through a local HTTP endpoint, or a
+    text file written periodically (e.g. for the textfile collector of
+    node_exporter).
+    """
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.MetricsExporter")
+
+    def __init__(self, registry: MetricsRegistry = registry):
+        self.registry = registry
+        self.server: Optional[HTTPServer] = None
+        self._stopped = threading.Event()
+
+    def serve_http(self, host: str = "127.0.0.1", port: int = 9464):
+        """
+        Serve metrics at ``http://host:port/metrics`` in background.
+
+        If the port can't be bound, e.g. it is used by another instance,
+        a warning is logged and metrics are not served.
+        """
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.server = _ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            self.logger.warning("Failed to serve metrics on %s:%s: %r",
+                                host, port, e)
+            return
+        threading.Thread(target=self.server.serve_forever,
+                         name="VoiceRecog metrics server",
+                         daemon=True).start()
+
+    def write_textfile(self, path: str, interval: float = 15):
+        """Write metrics to ``path`` every ``interval`` seconds."""
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    tmp = f"{path}.{os.getpid()}.tmp"
+                    with open(tmp, "w") as f:
+                        f.write(self.registry.render())
+                    # Replace atomically so readers never see half a file.
+                    os.replace(tmp, path)
+                except OSError as e:
+                    self.logger.warning("Failed to write metrics: %r", e)
+                self._stopped.wait(interval)
+
+        threading.Thread(target=run, name="VoiceRecog metrics writer",
+                         daemon=True).start()
+
+    def close(self):
+        """Stop serving and writing metrics."""
+        self._stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,206 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .deadline import Deadline
+
+
+class QuotaExceeded(RuntimeError):
+    """Raised when a call would exceed the quota of an engine."""
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def available(self) -> bool:
+        with self._lock:
+            self._refill()
+            return self.tokens >= 1
+
+    def acquire(self, deadline: Optional[Deadline] = None) -> bool:
+        """
+        Take a token, waiting for one if needed.
+
+        Returns:
+            ``False`` if no token is available before the deadline.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is None:
+                time.sleep(wait)
+                continue
+            remaining = deadline.remaining()
+            if deadline.cancelled.is_set() or \
+                    (remaining is not None and remaining < wait):
+                return False
+            deadline.cancelled.wait(wait)
+
+
+class QuotaStore:
+    """
+    Usage counters of all engines, kept in a JSON file.
+
+    Counters are grouped by period (``day`` and ``month``), and reset
+    when a new period starts. The file is saved at most every
+    ``save_interval`` seconds, and when the process exits.
+    """
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.QuotaStore")
+
+    def __init__(self, path: Optional[Path] = None,
+                 save_interval: float = 10):
+        self.path = path
+        self.save_interval = save_interval
+        self.usage: Dict[str, Dict[str, Any]] = dict()
+        self._saved = 0.0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if path is not None and path.exists():
+            try:
+                with path.open('r') as f:
+                    self.usage = json.load(f)
+            except ValueError:
+                self.logger.warning("Quota file %s is broken, ignored.", path)
+        if path is not None:
+            atexit.register(self.save)
+
+    @staticmethod
+    def periods() -> Dict[str, str]:
+        now = datetime.now()
+        return {"day": now.strftime("%Y-%m-%d"), "month": now.strftime("%Y-%m")}
+
+    def get(self, engine: str, period: str, unit: str) -> float:
+        """Usage of an engine in the current ``period``."""
+        with self._lock:
+            entry = self.usage.get(engine, dict()).get(period, dict())
+            if entry.get("id") != self.periods()[period]:
+                return 0
+            return entry.get(unit, 0)
+
+    def add(self, engine: str, requests: int, seconds: float):
+        """Count a call of an engine."""
+        with self._lock:
+            for period, period_id in self.periods().items():
+                entry = self.usage.setdefault(engine, dict()) \
+                    .setdefault(period, dict())
+                if entry.get("id") != period_id:
+                    entry.clear()
+                    entry["id"] = period_id
+                entry["requests"] = entry.get("requests", 0) + requests
+                entry["seconds"] = entry.get("seconds", 0) + seconds
+            due = time.monotonic() - self._saved >= self.save_interval
+        if due:
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self.usage)
+                self._saved = time.monotonic()
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Replace atomically, so a crash or a full disk never
+                # leaves a truncated file, which would reset the usage.
+                os.replace(tmp, self.path)
+            except OSError as e:
+                self.logger.warning("Failed to save quota usage: %r", e)
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+
+class RateLimiter:
+    """
+    Rate limit and quota of one engine.
+
+    ``rate_limit`` config: ``rate`` (requests per second) and ``burst``.
+    ``quota`` config: any of ``requests_per_day``, ``requests_per_month``,
+    ``seconds_per_day``, ``seconds_per_month``, and ``headroom``, the
+    fraction of each quota kept unused (default 0).
+    """
+
+    limits = {
+        "requests_per_day": ("day", "requests"),
+        "requests_per_month": ("month", "requests"),
+        "seconds_per_day": ("day", "seconds"),
+        "seconds_per_month": ("month", "seconds"),
+    }
+
+    def __init__(self, name: str, store: QuotaStore,
+                 rate_limit: Optional[Dict[str, float]] = None,
+                 quota: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.store = store
+        self.bucket: Optional[TokenBucket] = None
+        if rate_limit:
+            self.bucket = TokenBucket(rate_limit['rate'],
+                                      rate_limit.get('burst', 1))
+        quota = dict(quota or dict())
+        self.headroom: float = quota.pop('headroom', 0)
+        for key in quota:
+            if key not in self.limits:
+                raise ValueError(f"Unknown quota: {key}")
+        self.quota: Dict[str, float] = quota
+
+    def remaining(self, key: str) -> float:
+        """Usage left of a quota, after keeping the headroom."""
+        period, unit = self.limits[key]
+        limit = self.quota[key] * (1 - self.headroom)
+        return limit - self.store.get(self.name, period, unit)
+
+    @property
+    def available(self) -> bool:
+        """If the engine is below all its quotas and rate limit now."""
+        if self.bucket is not None and not self.bucket.available:
+            return False
+        return all(self.remaining(k) > 0 for k in self.quota)
+
+    def acquire(self, seconds: float, deadline: Optional[Deadline] = None):
+        """
+        Account for a call of ``seconds`` of audio, waiting for the rate
+        limit if needed.
+
+        Raises:
+            QuotaExceeded: if the call would exceed a quota, or the rate
+                limit does not allow it before the deadline.
+        """
+        for key in self.quota:
+            cost = seconds if self.limits[key][1] == "seconds" else 1
+            if self.remaining(key) < cost:
+                raise QuotaExceeded(f"{self.name} has run out of {key}.")
+        if self.bucket is not None and not self.bucket.acquire(deadline):
+            raise QuotaExceeded(f"{self.name} is rate limited.")
+        self.store.add(self.name, 1, seconds)
@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, List, \
+    Optional
+
+from . import metrics
+from .budget import MemoryBudget
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is rejected because the queue is full."""
+
+
+class Job:
+    """A recognition job waiting in the :class:`RecognitionScheduler`."""
+
+    def __init__(self, func: Callable, args: tuple, auto: bool = True,
+                 on_drop: Optional[Callable[[], Any]] = None,
+                 cost: int = 0, chat: Hashable = None):
+        self.func = func
+        self.args = args
+        self.auto = auto
+        self.on_drop = on_drop
+        # Jobs of the same chat are served in turn with other chats.
+        self.chat = chat
+        # Estimated bytes of memory the job takes while running
+        self.cost = cost
+        self.created: float = time.monotonic()
+
+    def drop(self):
+        if self.on_drop is not None:
+            self.on_drop()
+
+
+class FairQueue:
+    """
+    Jobs served round-robin by chat, and in order within a chat, so a
+    busy chat does not hold back the others.
+    """
+
+    def __init__(self):
+        # Chats in the order they are served next
+        self._chats: Dict[Hashable, Deque[Job]] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Job]:
+        for jobs in self._chats.values():
+            yield from jobs
+
+    def append(self, job: Job):
+        self._chats.setdefault(job.chat, deque()).append(job)
+        self._size += 1
+
+    def peek(self) -> Job:
+        """The job served next."""
+        return next(iter(self._chats.values()))[0]
+
+    def popleft(self) -> Job:
+        """Take the job served next; its chat goes to the end."""
+        chat, jobs = next(iter(self._chats.items()))
+        job = jobs.popleft()
+        del self._chats[chat]
+        if jobs:
+            self._chats[chat] = jobs
+        self._size -= 1
+        return job
+
+    def remove(self, job: Job):
+        jobs = self._chats[job.chat]
+        jobs.remove(job)
+        if not jobs:
+            del self._chats[job.chat]
+        self._size -= 1
+
+
+class RecognitionScheduler:
+    """
+    Long-lived worker pool with a bounded job queue.
+
+    When the queue is full, behaviour depends on ``overflow``:
+
+    * ``drop_oldest`` (default): drop the oldest auto recognition job
+      in the queue. Manual jobs are never dropped; they wait for a slot
+      instead.
+    * ``block``: wait until a slot is free. This blocks the thread
+      submitting the job, e.g. the one delivering messages in EFB.
+    * ``reject``: raise :class:`QueueFullError`.
+
+    Manual jobs are always served before auto recognition jobs, and
+    jobs of each kind are served round-robin by chat. With ``max_age``,
+    auto recognition jobs waiting longer than that many seconds are
+    dropped instead of run late.
+
+    With a :class:`.MemoryBudget`, the job at the head of the queue only
+    starts when its estimated memory fits in the budget; until then it
+    stays queued, and can still be dropped on overflow.
+    """
+
+    OVERFLOW_BLOCK = "block"
+    OVERFLOW_DROP_OLDEST = "drop_oldest"
+    OVERFLOW_REJECT = "reject"
+    overflow_modes = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_REJECT)
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.RecognitionScheduler")
+
+    def __init__(self, workers: int = 2, queue_size: int = 100,
+                 overflow: str = OVERFLOW_DROP_OLDEST,
+                 budget: Optional[MemoryBudget] = None,
+                 max_age: Optional[float] = None):
+        if overflow not in self.overflow_modes:
+            raise ValueError(f"Unknown overflow mode: {overflow}")
+        self.queue_size = max(1, queue_size)
+        self.overflow = overflow
+        self.budget = budget
+        self.max_age = max_age
+        self._manual = FairQueue()
+        self._auto = FairQueue()
+        self._cond = threading.Condition()
+        self._running = True
+        self._threads: List[threading.Thread] = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker,
+                                 name=f"VoiceRecog worker {i}",
+                                 daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def qsize(self) -> int:
+        """Number of jobs waiting in the queue."""
+        with self._cond:
+            return len(self._manual) + len(self._auto)
+
+    def _queue_of(self, job: Job) -> FairQueue:
+        return self._auto if job.auto else self._manual
+
+    def _next_queue(self) -> Optional[FairQueue]:
+        """Queue of the job served next. Lock must be held."""
+        if self._manual:
+            return self._manual
+        if self._auto:
+            return self._auto
+        return None
+
+    def submit(self, func: Callable, *args, auto: bool = True,
+               on_drop: Optional[Callable[[], Any]] = None, cost: int = 0,
+               chat: Hashable = None):
+        """
+        Queue ``func(*args)`` to run in a worker thread.
+
+        Arguments:
+            auto: If the job comes from auto recognition.
+            on_drop: Called when the job is dropped from the queue
+                without running.
+            cost: Estimated bytes of memory the job takes.
+            chat: Chat of the voice message, for round-robin.
+
+        Raises:
+            QueueFullError: if the queue is full and overflow mode
+                is ``reject``.
+        """
+        job = Job(func, args, auto, on_drop, cost, chat)
+        dropped: Optional[Job] = None
+        with self._cond:
+            while len(self._manual) + len(self._auto) >= self.queue_size:
+                if self.overflow == self.OVERFLOW_REJECT:
+                    raise QueueFullError(
+                        f"Recognition queue is full ({self.queue_size}).")
+                if self.overflow == self.OVERFLOW_DROP_OLDEST:
+                    dropped = min(self._auto, key=lambda i: i.created,
+                                  default=None)
+                    if dropped is not None:
+                        self._auto.remove(dropped)
+                        break
+                    if job.auto:
+                        # Nothing older can be dropped for an auto job.
+                        dropped = job
+                        break
+                self._cond.wait()
+            if dropped is not job:
+                self._queue_of(job).append(job)
+                self._cond.notify_all()
+        if dropped is not None:
+            self.logger.warning("Recognition queue is full, "
+                                "dropped an auto recognition job.")
+            dropped.drop()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    stale = self._expire()
+                    if stale or not self._running or self._admit():
+                        break
+                    self._cond.wait(self._next_expiry())
+                if not self._running:
+                    return
+                if not stale:
+                    job = self._next_queue().popleft()
+                # Wake up producers waiting for a free slot.
+                self._cond.notify_all()
+            if stale:
+                self.logger.warning(
+                    "Dropped %d auto recognition jobs older than %s s.",
+                    len(stale), self.max_age)
+                for i in stale:
+                    i.drop()
+                continue
+            metrics.queue_wait_seconds.observe(time.monotonic() - job.created)
+            try:
+                job.func(*job.args)
+            except Exception:
+                self.logger.exception("Recognition job failed.")
+            finally:
+                if self.budget is not None:
+                    self.budget.release(job.cost)
+                    # Wake up workers waiting for memory.
+                    with self._cond:
+                        self._cond.notify_all()
+
+    def _admit(self) -> bool:
+        """
+        If the job at the head of the queue can start, reserving its
+        memory. Lock must be held.
+        """
+        queue = self._next_queue()
+        if queue is None:
+            return False
+        return self.budget is None or \
+            self.budget.acquire(queue.peek().cost, timeout=0)
+
+    def _expire(self) -> List[Job]:
+        """Remove auto jobs older than ``max_age``. Lock must be held."""
+        if not self.max_age:
+            return []
+        limit = time.monotonic() - self.max_age
+        stale = [i for i in self._auto if i.created < limit]
+        for i in stale:
+            self._auto.remove(i)
+        return stale
+
+    def _next_expiry(self) -> Optional[float]:
+        """Seconds until an auto job is too old. Lock must be held."""
+        if not self.max_age or not self._auto:
+            return None
+        oldest = min(i.created for i in self._auto)
+        return max(0.0, oldest + self.max_age - time.monotonic())
+
+    def shutdown(self):
+        """Stop all workers, dropping jobs still in the queue."""
+        with self._cond:
+            self._running = False
+            jobs = list(self._manual) + list(self._auto)
+            self._manual = FairQueue()
+            self._auto = FairQueue()
+            self._cond.notify_all()
+        for job in jobs:
+            job.drop()
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Iterable, Optional, Tuple
+
+
+class LoadShedder:
+    """
+    Degrade recognition while the middleware is overloaded.
+
+    Shedding starts when the queue depth reaches ``queue_depth``, or the
+    p95 end-to-end latency of recent messages reaches ``latency``. It
+    stops only when both are back under ``recover`` times their
+    thresholds, and not before ``hold`` seconds, so it does not flap.
+
+    Actions while shedding, for auto recognition only:
+
+    * ``single_engine``: send each clip to one engine at a time
+      (``cascade`` dispatch), instead of every engine.
+    * ``skip_long``: skip clips longer than ``max_duration`` seconds,
+      as estimated from their file before decoding.
+    * ``low_priority``: skip chats listed in ``low_priority_chats``,
+      and all group chats if ``low_priority_groups`` is set.
+    """
+
+    ACTION_SINGLE_ENGINE = "single_engine"
+    ACTION_SKIP_LONG = "skip_long"
+    ACTION_LOW_PRIORITY = "low_priority"
+    actions = (ACTION_SINGLE_ENGINE, ACTION_SKIP_LONG, ACTION_LOW_PRIORITY)
+
+    logger: logging.Logger = logging.getLogger(
+        "plugins.catbaron.voice_recog.LoadShedder")
+
+    def __init__(self, depth: Callable[[], int],
+                 queue_depth: Optional[int] = 20,
+                 latency: Optional[float] = 60,
+                 recover: float = 0.5, hold: float = 30,
+                 window: float = 120,
+                 actions: Iterable[str] = actions,
+                 max_duration: float = 30,
+                 low_priority_chats: Iterable[str] = (),
+                 low_priority_groups: bool = False):
+        """
+        Arguments:
+            depth: Current queue depth.
+            queue_depth: Queue depth that starts shedding, or ``None``.
+            latency: p95 latency in seconds that starts shedding, or
+                ``None``.
+            recover: Fraction of the thresholds under which shedding
+                stops.
+            hold: Shortest time in seconds to keep shedding.
+            window: Seconds of latencies kept for the p95.
+            actions: Actions taken while shedding.
+            max_duration: Longest clip in seconds recognized with
+                ``skip_long``.
+            low_priority_chats: Chat IDs skipped with ``low_priority``.
+            low_priority_groups: If group chats are skipped with
+                ``low_priority``.
+        """
+        for action in actions:
+            if action not in self.actions:
+                raise ValueError(f"Unknown shedding action: {action}")
+        self.depth = depth
+        self.queue_depth = queue_depth
+        self.latency = latency
+        self.recover = recover
+        self.hold = hold
+        self.window = window
+        self.enabled_actions = set(actions)
+        self.max_duration = max_duration
+        self.low_priority_chats = set(str(i) for i in low_priority_chats)
+        self.low_priority_groups = low_priority_groups
+        self.shedding = False
+        self._since = 0.0
+        # (time, latency) of recent messages
+        self._latencies: Deque[Tuple[float, float]] = deque()
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+
+    def record(self, latency: float):
+        """Record the end-to-end latency of a message."""
+        with self._lock:
+            self._latencies.append((time.monotonic(), latency))
+
+    def p95(self) -> Optional[float]:
+        """p95 latency in the window, ``None`` if there is none."""
+        with self._lock:
+            limit = time.monotonic() - self.window
+            while self._latencies and self._latencies[0][0] < limit:
+                self._latencies.popleft()
+            data = sorted(i for _, i in self._latencies)
+        if not data:
+            return None
+        return data[min(len(data) - 1, int(0.95 * len(data)))]
+
+    def _over(self, factor: float) -> bool:
+        """If load is at or above the thresholds times ``factor``."""
+        if self.queue_depth is not None and \
+                self.depth() >= self.queue_depth * factor:
+            return True
+        p95 = self.p95()
+        return self.latency is not None and p95 is not None and \
+            p95 >= self.latency * factor
+
+    def update(self) -> bool:
+        """Start or stop shedding by the current load, and return it."""
+        with self._state_lock:
+            now = time.monotonic()
+            if not self.shedding:
+                if self._over(1):
+                    self.shedding = True
+                    self._since = now
+                    self.logger.warning(
+                        "Overloaded (queue depth %d, p95 latency %s s), "
+                        "shedding load.", self.depth(), self.p95())
+            elif now - self._since >= self.hold and \
+                    not self._over(self.recover):
+                self.shedding = False
+                self.logger.warning(
+                    "Load is back to normal, stopped shedding.")
+            return self.shedding
+
+    def active(self, action: str) -> bool:
+        """If ``action`` is to be taken now."""
+        return action in self.enabled_actions and self.update()
+
+    def low_priority(self, chat_id: str, group: bool) -> bool:
+        """If a chat is left out while shedding."""
+        return str(chat_id) in self.low_priority_chats or \
+            (group and self.low_priority_groups)
@@ -0,0 +1,213 @@
+import atexit
+import multiprocessing
+import os
+import signal
+import threading
+from io import BytesIO
+from multiprocessing.pool import Pool
+from typing import Any, Optional, Set, Union
+
+try:
+    import av
+except ImportError:  # PyAV is optional
+    av = None
+
+NATIVE_DECODER: bool = av is not None
+"""If PyAV is installed to decode clips without ffmpeg processes"""
+
+TranscodeSource = Union[str, bytes]
+"""Path of an audio file, or its content"""
+
+
+# Values of a job slot whose job is given up before it starts, or done;
+# otherwise the PID of its worker, or 0 while it is free or queued
+_CANCELLED = -1
+_DONE = -2
+
+# PID of the worker running the job of each slot, shared by all workers
+_jobs: Any = None
+
+
+def _init_worker(jobs):
+    global _jobs
+    _jobs = jobs
+    # Import the decoder once per worker, not once per job.
+    import pydub  # noqa: F401
+
+
+def _run(slot: Optional[int], *args) -> Optional[bytes]:
+    """Run :func:`_decode`, recording this worker in the job slot."""
+    if slot is None:
+        return _decode(*args)
+    with _jobs.get_lock():
+        if _jobs[slot] == _CANCELLED:
+            _jobs[slot] = 0
+            return None
+        _jobs[slot] = os.getpid()
+    try:
+        return _decode(*args)
+    finally:
+        with _jobs.get_lock():
+            _jobs[slot] = _DONE
+
+
+def _decode_av(source: TranscodeSource, rate: int, channels: int) -> bytes:
+    """Decode with the native decoders of PyAV, without ffmpeg processes."""
+    layout = "mono" if channels == 1 else "stereo"
+    resampler = av.AudioResampler(format="s16", layout=layout, rate=rate)
+    out = bytearray()
+
+    def take(frames):
+        # PyAV < 9 returns a frame or None instead of a list.
+        if frames is None:
+            return
+        if not isinstance(frames, list):
+            frames = [frames]
+        for frame in frames:
+            # Planes may be padded, keep only the samples.
+            out.extend(bytes(frame.planes[0])[
+                :frame.samples * channels * 2])
+
+    with av.open(BytesIO(source) if isinstance(source, bytes) else source) \
+            as container:
+        for frame in container.decode(audio=0):
+            frame.pts = None
+            take(resampler.resample(frame))
+    try:
+        take(resampler.resample(None))
+    except (TypeError, ValueError):
+        pass  # PyAV < 9 cannot flush
+    return bytes(out)
+
+
+def _decode(source: TranscodeSource, format: Optional[str],
+            rate: int, channels: int, sample_width: int) -> bytes:
+    """Decode an audio file to raw PCM in a worker process."""
+    if av is not None and sample_width == 2:
+        try:
+            return _decode_av(source, rate, channels)
+        except Exception:
+            # Fall back to ffmpeg, which may know more formats.
+            pass
+    import pydub
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    return pydub.AudioSegment.from_file(source, format=format)\
+        .set_frame_rate(rate)\
+        .set_channels(channels)\
+        .set_sample_width(sample_width)\
+        .raw_data
+
+
+class Transcoder:
+    """
+    Pool of long-lived decoder processes.
+
+    Jobs are sent to workers over pipes, and PCM is returned. Workers
+    decode with PyAV when it is installed, so no ffmpeg process is
+    started per clip; otherwise they use pydub and ffmpeg. Each worker
+    is replaced after ``max_tasks`` jobs, to bound leaks of native
+    decoders, and a worker whose job times out is terminated and
+    replaced, so stuck decoders do not fill the pool. The pool is
+    started on first use.
+    """
+
+    # Jobs tracked at once; more are run, but not stopped on timeout.
+    slots: int = 256
+
+    def __init__(self, processes: int = 2, max_tasks: int = 100,
+                 timeout: Optional[float] = 60):
+        """
+        Arguments:
+            processes: Number of worker processes.
+            max_tasks: Jobs run by a worker before it is replaced.
+            timeout: Seconds to wait for a job.
+        """
+        self.processes = max(1, processes)
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self._pool: Optional[Pool] = None
+        self._jobs: Any = None
+        # Slots of jobs waited for in this process
+        self._busy: Set[int] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> Pool:
+        with self._lock:
+            if self._pool is None:
+                # Forking a process with running threads is unsafe.
+                context = multiprocessing.get_context("spawn")
+                self._jobs = context.Array('i', self.slots)
+                self._pool = context.Pool(
+                    self.processes, initializer=_init_worker,
+                    initargs=(self._jobs,),
+                    maxtasksperchild=self.max_tasks)
+                atexit.register(self.close)
+            return self._pool
+
+    def decode(self, source: TranscodeSource, format: Optional[str] = None,
+               rate: int = 16000, channels: int = 1, sample_width: int = 2,
+               timeout: Optional[float] = None) -> bytes:
+        """
+        Decode an audio file to raw PCM.
+
+        Arguments:
+            source: Path of the file, or its content.
+            format: Format of the file, if known.
+            timeout: Seconds to wait, default to :attr:`timeout`.
+
+        Raises:
+            multiprocessing.TimeoutError: if the job takes too long. The
+                job is then stopped, terminating its worker if it has
+                started.
+        """
+        pool = self.pool
+        slot = self._take_slot()
+        try:
+            job = pool.apply_async(
+                _run, (slot, source, format, rate, channels, sample_width))
+            try:
+                return job.get(self.timeout if timeout is None else timeout)
+            except multiprocessing.TimeoutError:
+                if slot is not None:
+                    self._stop(slot)
+                raise
+        finally:
+            if slot is not None:
+                with self._lock, self._jobs.get_lock():
+                    if self._jobs[slot] == _DONE:
+                        self._jobs[slot] = 0
+                    self._busy.discard(slot)
+
+    def _take_slot(self) -> Optional[int]:
+        """A free job slot, or ``None`` if all are in use."""
+        with self._lock, self._jobs.get_lock():
+            for slot in range(self.slots):
+                if slot not in self._busy and self._jobs[slot] == 0:
+                    self._busy.add(slot)
+                    return slot
+        return None
+
+    def _stop(self, slot: int):
+        """Stop the job of a slot: cancel it, or terminate its worker."""
+        with self._jobs.get_lock():
+            pid = self._jobs[slot]
+            if pid == 0:
+                # Still queued; the worker skips it and frees the slot.
+                self._jobs[slot] = _CANCELLED
+                return
+            if pid == _DONE:
+                return
+            # The pool starts a new worker in its place.
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            self._jobs[slot] = 0
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
@@ -0,0 +1,93 @@
+from typing import List, Tuple
+
+try:
+    import audioop
+except ImportError:  # removed in Python 3.13
+    from pydub import pyaudioop as audioop
+
+
+class VoiceActivityDetector:
+    """
+    Find speech in 16-bit PCM by the loudness of short frames.
+
+    Silence is trimmed from both ends of a clip, keeping ``padding``
+    around speech, and clips longer than ``max_chunk`` are split at
+    pauses, so the chunks can be recognized in parallel.
+    """
+
+    def __init__(self, threshold: float = -40, frame: float = 0.03,
+                 padding: float = 0.3, min_pause: float = 0.5,
+                 max_chunk: float = 15, sample_rate: int = 16000,
+                 sample_width: int = 2, channels: int = 1):
+        """
+        Arguments:
+            threshold: Loudness in dBFS under which a frame is silent.
+            frame: Length of a frame in seconds.
+            padding: Seconds of silence kept around speech.
+            min_pause: Shortest pause in seconds where a clip is split.
+            max_chunk: Longest chunk in seconds, 0 to never split.
+        """
+        self.sample_width = sample_width
+        self.frame_bytes = \
+            int(sample_rate * frame) * sample_width * channels
+        self.threshold = (2 ** (8 * sample_width - 1)) * \
+            10 ** (threshold / 20)
+        self.padding = int(padding / frame)
+        self.min_pause = max(1, int(min_pause / frame))
+        self.max_chunk = int(max_chunk / frame) if max_chunk else 0
+
+    def voiced(self, pcm: bytes) -> List[bool]:
+        """If each frame of ``pcm`` is louder than the threshold."""
+        view = memoryview(pcm)
+        return [audioop.rms(view[i:i + self.frame_bytes],
+                            self.sample_width) >= self.threshold
+                for i in range(0, len(view), self.frame_bytes)]
+
+    def pauses(self, voiced: List[bool]) -> List[Tuple[int, int]]:
+        """Frame ranges of pauses between speech."""
+        pauses = []
+        start = None
+        for i, v in enumerate(voiced):
+            if not v and start is None:
+                start = i
+            elif v and start is not None:
+                if start > 0 and i - start >= self.min_pause:
+                    pauses.append((start, i))
+                start = None
+        return pauses
+
+    def split(self, pcm: bytes) -> List[Tuple[int, int]]:
+        """
+        Byte ranges of the chunks of ``pcm`` to recognize, in order.
+
+        Returns:
+            One range without the silence at both ends, or several if
+            the clip is long; none if the clip is silent.
+        """
+        voiced = self.voiced(pcm)
+        if not any(voiced):
+            return []
+        first = voiced.index(True)
+        last = len(voiced) - voiced[::-1].index(True)
+        start = max(0, first - self.padding)
+        end = min(len(voiced), last + self.padding)
+
+        chunks = []
+        pauses = self.pauses(voiced)
+        while self.max_chunk and end - start > self.max_chunk:
+            limit = start + self.max_chunk
+            fits = [p for p in pauses
+                    if start < p[0] and p[0] + self.padding <= limit]
+            if fits:
+                # Split at the last pause, dropping its middle.
+                pause_start, pause_end = fits[-1]
+                middle = (pause_start + pause_end) // 2
+                stop = min(pause_start + self.padding, middle)
+                resume = max(pause_end - self.padding, middle)
+            else:
+                stop = resume = limit
+            chunks.append((start, stop))
+            start = resume
+        chunks.append((start, end))
+        return [(s * self.frame_bytes, min(len(pcm), e * self.frame_bytes))
+                for s, e in chunks]
@@ -1,8 +1,8 @@
 import sys
 from setuptools import setup, find_packages
 
-if sys.version_info < (3, 6):
-    raise Exception("Python 3.6 or higher is required. Your version is %s." % sys.version)
+if sys.version_info < (3, 7):
+    raise Exception("Python 3.7 or higher is required. Your version is %s." % sys.version)
 
 __version__ = ""
 exec(open('efb_voice_recog_middleware/__version__.py').read())
@@ -22,7 +22,7 @@ setup(
     author_email='catbaron@live.cn',
 #    url='https://github.com/blueset/efb-wechat-slave',
     license='AGPLv3+',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     keywords=['ehforwarderbot', 'EH Forwarder Bot', 'EH Forwarder Bot Slave Channel',
               'wechat', 'weixin', 'chatbot'],
     classifiers=[
@@ -31,7 +31,6 @@ setup(
         "Intended Audience :: Developers",
         "Intended Audience :: End Users/Desktop",
         "Programming Language :: Python :: 3 :: Only",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Topic :: Communications :: Chat",
         "Topic :: Utilities"
@@ -40,10 +39,26 @@ setup(
         "ehforwarderbot>=2.0.0b5",
         "PyYaml",
         "pydub>=0.23.1",
+        "requests",
         "tencentcloud-sdk-python",
         "websocket_client"
     ],
+    extras_require={
+        'async': ["aiohttp>=3.6"],
+        'native': ["av"],
+        'vosk': ["vosk"]
+    },
     entry_points={
-        'ehforwarderbot.middleware': 'catbaron.voice_recog = efb_voice_recog_middleware:VoiceRecogMiddleware'
+        'ehforwarderbot.middleware': 'catbaron.voice_recog = efb_voice_recog_middleware:VoiceRecogMiddleware',
+        'console_scripts': [
+            'efb-voice-recog = efb_voice_recog_middleware.cli:main',
+        ],
+        'efb_voice_recog_middleware.engines': [
+            'baidu = efb_voice_recog_middleware.engines.baidu:BaiduSpeech',
+            'azure = efb_voice_recog_middleware.engines.azure:AzureSpeech',
+            'iflytek = efb_voice_recog_middleware.engines.iflytek:IFlyTekSpeech',
+            'tencent = efb_voice_recog_middleware.engines.tencent:TencentSpeech',
+            'vosk = efb_voice_recog_middleware.engines.vosk:VoskSpeech',
+        ]
     }
 )
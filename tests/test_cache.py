@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from efb_voice_recog_middleware.cache import TranscriptionCache
+from efb_voice_recog_middleware.deadline import DeadlineExceeded
+
+KEY = ("digest", "Engine", "zh")
+
+
+def run_in_threads(*targets):
+    threads = [threading.Thread(target=t) for t in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+
+def test_concurrent_lookups_compute_once():
+    cache = TranscriptionCache()
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return ["text"]
+
+    def lookup():
+        results.append(cache.get_or_compute(KEY, compute, 5))
+
+    run_in_threads(lookup, lookup, lookup)
+    assert len(calls) == 1
+    assert results == [["text"]] * 3
+    assert cache.get(KEY) == ["text"]
+
+
+def test_errors_are_not_cached():
+    cache = TranscriptionCache()
+    assert cache.get_or_compute(KEY, lambda: ["ERROR!", "boom"]) == \
+        ["ERROR!", "boom"]
+    assert cache.get(KEY) is None
+    assert cache.get_or_compute(KEY, lambda: ["text"]) == ["text"]
+
+
+def test_exceptions_are_shared_with_followers():
+    cache = TranscriptionCache()
+    errors = []
+
+    def compute():
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    def lookup():
+        try:
+            cache.get_or_compute(KEY, compute, 5)
+        except ValueError as e:
+            errors.append(e)
+
+    run_in_threads(lookup, lookup)
+    assert len(errors) == 2
+    assert cache.get(KEY) is None
+
+
+def test_follower_computes_again_when_leader_is_cancelled():
+    cache = TranscriptionCache()
+    outcomes = []
+
+    def cancelled():
+        time.sleep(0.2)
+        raise DeadlineExceeded("Cancelled.")
+
+    def leader():
+        try:
+            cache.get_or_compute(KEY, cancelled, 5)
+        except DeadlineExceeded:
+            outcomes.append("leader cancelled")
+
+    def follower():
+        time.sleep(0.05)
+        outcomes.append(cache.get_or_compute(KEY, lambda: ["text"], 5))
+
+    run_in_threads(leader, follower)
+    assert sorted(outcomes, key=str) == [["text"], "leader cancelled"]
+
+
+def test_persists_on_disk(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    TranscriptionCache(path).put(KEY, ["text"])
+    assert TranscriptionCache(path).get(KEY) == ["text"]
+
+
+def test_async_lookups_compute_once():
+    cache = TranscriptionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return ["text"]
+
+    async def main():
+        return await asyncio.gather(*(
+            cache.get_or_compute_async(KEY, compute, 5) for _ in range(3)))
+
+    assert asyncio.run(main()) == [["text"]] * 3
+    assert len(calls) == 1
+
+
+def test_async_follower_computes_again_when_leader_is_cancelled():
+    cache = TranscriptionCache()
+
+    async def cancelled():
+        await asyncio.sleep(0.2)
+        raise DeadlineExceeded("Cancelled.")
+
+    async def compute():
+        return ["text"]
+
+    async def follower():
+        await asyncio.sleep(0.05)
+        return await cache.get_or_compute_async(KEY, compute, 5)
+
+    async def main():
+        return await asyncio.gather(
+            cache.get_or_compute_async(KEY, cancelled, 5), follower(),
+            return_exceptions=True)
+
+    leader, result = asyncio.run(main())
+    assert isinstance(leader, DeadlineExceeded)
+    assert result == ["text"]
+
+
+def test_follower_gives_up_after_timeout():
+    cache = TranscriptionCache()
+    errors = []
+
+    def leader():
+        cache.get_or_compute(KEY, lambda: time.sleep(0.5) or ["text"])
+
+    def follower():
+        time.sleep(0.05)
+        try:
+            cache.get_or_compute(KEY, lambda: ["other"], 0.1)
+        except Exception as e:
+            errors.append(e)
+
+    run_in_threads(leader, follower)
+    assert len(errors) == 1
+    assert isinstance(errors[0], FutureTimeoutError)
@@ -0,0 +1,129 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from efb_voice_recog_middleware.deadline import Deadline, DeadlineExceeded
+from efb_voice_recog_middleware.engines.http import HTTPSession
+
+
+class SlowHandler(http.server.BaseHTTPRequestHandler):
+    """Answers ``ok`` after the number of seconds in the path."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(float(self.path.strip("/")))
+        try:
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+        except OSError:
+            # The client has gone away.
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_timeout_is_capped_by_time_left():
+    deadline = Deadline(1)
+    assert deadline.timeout(None) <= 1
+    assert deadline.timeout(0.5) == 0.5
+    assert Deadline().timeout(3) == 3
+    assert Deadline().remaining() is None
+
+
+def test_check_raises_when_expired_or_cancelled():
+    deadline = Deadline(0.05)
+    deadline.check()
+    time.sleep(0.1)
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+    deadline = Deadline(10)
+    deadline.cancel()
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+
+
+def test_cancel_runs_callbacks_once():
+    deadline = Deadline()
+    calls = []
+    deadline.on_cancel(lambda: calls.append("first"))
+    deadline.on_cancel(lambda: 1 / 0)
+    deadline.on_cancel(lambda: calls.append("second"))
+    deadline.cancel()
+    deadline.cancel()
+    assert calls == ["first", "second"]
+
+
+def test_callback_runs_at_once_when_already_cancelled():
+    deadline = Deadline()
+    deadline.cancel()
+    calls = []
+    deadline.on_cancel(lambda: calls.append(1))
+    assert calls == [1]
+
+
+def test_child_is_cancelled_with_parent():
+    parent = Deadline(10)
+    child = parent.child()
+    assert child.expires_at == parent.expires_at
+    parent.cancel()
+    assert child.cancelled.is_set()
+
+
+def test_sleep_wakes_up_when_cancelled():
+    deadline = Deadline(10)
+    threading.Timer(0.1, deadline.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        deadline.sleep(5)
+    assert time.monotonic() - started < 1
+
+
+def test_http_request_is_cut_short_when_cancelled(server_url):
+    session = HTTPSession({})
+    deadline = Deadline(10)
+    threading.Timer(0.2, deadline.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        session.post(server_url + "3", deadline, data=b"x")
+    assert time.monotonic() - started < 1
+    session.close()
+
+
+def test_http_session_is_reusable_after_cancel(server_url):
+    session = HTTPSession({})
+    deadline = Deadline(10)
+    threading.Timer(0.2, deadline.cancel).start()
+    with pytest.raises(DeadlineExceeded):
+        session.post(server_url + "3", deadline, data=b"x")
+    done = Deadline(5)
+    assert session.post(server_url + "0", done, data=b"x").text == "ok"
+    # Cancelling a finished request leaves pooled connections alone.
+    done.cancel()
+    assert session.post(server_url + "0", Deadline(5), data=b"x").text == \
+        "ok"
+    session.close()
+
+
+def test_http_request_is_not_sent_after_expiry(server_url):
+    session = HTTPSession({})
+    deadline = Deadline(10)
+    deadline.cancel()
+    with pytest.raises(DeadlineExceeded):
+        session.post(server_url + "0", deadline, data=b"x")
+    session.close()
@@ -0,0 +1,147 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+import pytest
+
+from efb_voice_recog_middleware.deadline import Deadline, DeadlineExceeded
+from efb_voice_recog_middleware.dispatch import Dispatcher
+from efb_voice_recog_middleware.engines import SpeechEngine
+
+
+class FakeEngine(SpeechEngine):
+    """Engine answering ``result`` after ``delay`` seconds."""
+
+    def __init__(self, name: str, delay: float = 0,
+                 result: List[str] = None):
+        self.engine_name = name
+        self.lang = "zh"
+        self.delay = delay
+        self.result = result or [f"text of {name}"]
+        self.calls = 0
+        self.cancelled = False
+
+    def recognize(self, file=None, lang="", deadline=None):
+        self.calls += 1
+        if deadline is not None:
+            if deadline.cancelled.wait(self.delay):
+                self.cancelled = True
+                raise DeadlineExceeded("Cancelled.")
+        else:
+            time.sleep(self.delay)
+        return self.result
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(8) as executor:
+        yield executor
+
+
+def dispatch(executor, engines, deadline=None, **kwargs):
+    def submit(engine: SpeechEngine, d: Deadline) -> Future:
+        return executor.submit(engine.recognize, None, deadline=d)
+    policy = kwargs.pop("policy", None)
+    return list(Dispatcher(**kwargs).dispatch(
+        engines, submit, deadline, policy))
+
+
+def test_all_waits_for_every_engine(executor):
+    fast, slow = FakeEngine("fast"), FakeEngine("slow", delay=0.2)
+    results = dispatch(executor, [slow, fast], policy="all")
+    assert [r.engine for r in results] == [fast, slow]
+    assert not any(r.failed for r in results)
+
+
+def test_race_returns_first_success_and_cancels_others(executor):
+    fast, slow = FakeEngine("fast", 0.05), FakeEngine("slow", delay=5)
+    started = time.monotonic()
+    results = dispatch(executor, [slow, fast], policy="race")
+    assert [r.engine for r in results] == [fast]
+    assert time.monotonic() - started < 1
+    executor.shutdown(wait=True)
+    assert slow.cancelled
+
+
+def test_race_skips_error_results(executor):
+    broken = FakeEngine("broken", result=["ERROR!", "boom"])
+    good = FakeEngine("good", delay=0.1)
+    results = dispatch(executor, [broken, good], policy="race")
+    assert [r.engine for r in results] == [good]
+
+
+def test_race_reports_failures_if_no_engine_succeeds(executor):
+    a = FakeEngine("a", result=["ERROR!", "a"])
+    b = FakeEngine("b", result=["ERROR!", "b"])
+    results = dispatch(executor, [a, b], policy="race")
+    assert {r.engine for r in results} == {a, b}
+    assert all(r.failed for r in results)
+
+
+def test_cascade_moves_on_after_failure(executor):
+    broken = FakeEngine("broken", result=["ERROR!", "boom"])
+    good = FakeEngine("good")
+    results = dispatch(executor, [broken, good], policy="cascade")
+    assert [r.engine for r in results] == [good]
+    assert broken.calls == good.calls == 1
+
+
+def test_cascade_does_not_start_next_after_success(executor):
+    first, second = FakeEngine("first"), FakeEngine("second")
+    results = dispatch(executor, [first, second], policy="cascade")
+    assert [r.engine for r in results] == [first]
+    assert second.calls == 0
+
+
+def test_cascade_gives_up_on_slow_engine(executor):
+    slow, fast = FakeEngine("slow", delay=5), FakeEngine("fast")
+    started = time.monotonic()
+    results = dispatch(executor, [slow, fast], policy="cascade",
+                       timeout=0.1)
+    assert [r.engine for r in results] == [fast]
+    assert time.monotonic() - started < 1
+    executor.shutdown(wait=True)
+    assert slow.cancelled
+
+
+def test_hedged_starts_next_engine_when_slow(executor):
+    slow, fast = FakeEngine("slow", delay=5), FakeEngine("fast")
+    started = time.monotonic()
+    results = dispatch(executor, [slow, fast], policy="hedged",
+                       hedge_delay=0.1)
+    elapsed = time.monotonic() - started
+    assert [r.engine for r in results] == [fast]
+    assert 0.1 <= elapsed < 1
+
+
+def test_hedged_keeps_first_engine_when_fast(executor):
+    first, second = FakeEngine("first", 0.05), FakeEngine("second")
+    results = dispatch(executor, [first, second], policy="hedged",
+                       hedge_delay=1)
+    assert [r.engine for r in results] == [first]
+    assert second.calls == 0
+
+
+def test_policy_of_call_overrides_default(executor):
+    a, b = FakeEngine("a"), FakeEngine("b", delay=0.1)
+    results = dispatch(executor, [a, b], policy="cascade")
+    assert len(results) == 1
+    results = dispatch(executor, [a, b])
+    assert len(results) == 2
+
+
+@pytest.mark.parametrize("policy", Dispatcher.policies)
+def test_deadline_expiry_reports_timeout(executor, policy):
+    slow = FakeEngine("slow", delay=5)
+    started = time.monotonic()
+    results = dispatch(executor, [slow], Deadline(0.2), policy=policy)
+    assert time.monotonic() - started < 1
+    assert len(results) == 1
+    assert isinstance(results[0].error, DeadlineExceeded)
+    executor.shutdown(wait=True)
+    assert slow.cancelled
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Dispatcher(policy="fastest")
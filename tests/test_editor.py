@@ -0,0 +1,91 @@
+import threading
+import time
+from typing import List, Tuple
+
+from ehforwarderbot import Message
+from ehforwarderbot.chat import PrivateChat
+
+from efb_voice_recog_middleware.editor import MessageEditor
+
+
+class Sent:
+    """Messages sent by an editor, with the time they were sent."""
+
+    def __init__(self):
+        self.messages: List[Tuple[float, str, str]] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, message: Message):
+        with self.lock:
+            self.messages.append(
+                (time.monotonic(), message.uid, message.text))
+
+    @property
+    def texts(self) -> List[str]:
+        with self.lock:
+            return [text for _, _, text in self.messages]
+
+
+def message(text: str, uid: str = "m1", chat: str = "c1") -> Message:
+    chat = PrivateChat(module_id="test.slave", module_name="Test",
+                       uid=chat, name=chat)
+    return Message(chat=chat, author=chat.other, uid=uid, text=text)
+
+
+def test_close_updates_are_merged_into_one_edit():
+    sent = Sent()
+    editor = MessageEditor(sent, debounce=0.1, interval=0)
+    editor.update(message("a"))
+    editor.update(message("a b"))
+    time.sleep(0.3)
+    assert sent.texts == ["a b"]
+
+
+def test_final_edit_is_sent_at_once_and_never_overtaken():
+    sent = Sent()
+    editor = MessageEditor(sent, debounce=0.1, interval=0)
+    editor.update(message("a"))
+    editor.finish(message("a b"))
+    assert sent.texts == ["a b"]
+    # The pending intermediate edit is dropped.
+    time.sleep(0.3)
+    assert sent.texts == ["a b"]
+
+
+def test_edits_in_a_chat_are_spaced_by_interval():
+    sent = Sent()
+    editor = MessageEditor(sent, debounce=0.01, interval=0.3)
+    editor.update(message("1", uid="m1"))
+    time.sleep(0.1)
+    editor.update(message("2", uid="m2"))
+    time.sleep(0.6)
+    (first, _, _), (second, _, _) = sent.messages
+    assert second - first >= 0.25
+
+
+def test_chats_do_not_delay_each_other():
+    sent = Sent()
+    editor = MessageEditor(sent, debounce=0.01, interval=5)
+    editor.update(message("1", chat="c1"))
+    time.sleep(0.1)
+    editor.update(message("2", chat="c2"))
+    time.sleep(0.2)
+    assert sorted(sent.texts) == ["1", "2"]
+
+
+def test_idle_chats_are_forgotten():
+    editor = MessageEditor(Sent(), debounce=0, interval=0.05)
+    for i in range(10):
+        editor.finish(message("text", uid=f"m{i}", chat=f"c{i}"))
+    time.sleep(0.1)
+    editor.finish(message("text", uid="last", chat="last"))
+    assert list(editor._last_edit) == [("test.slave", "last")]
+    assert not editor._pending
+
+
+def test_failed_send_is_logged_not_raised():
+    def send(message: Message):
+        raise RuntimeError("offline")
+
+    editor = MessageEditor(send)
+    editor.finish(message("text"))
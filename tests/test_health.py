@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import Future
+
+from efb_voice_recog_middleware.dispatch import Dispatcher, \
+    EngineUnavailable
+from efb_voice_recog_middleware.engines import SpeechEngine
+from efb_voice_recog_middleware.health import EngineHealth
+
+
+class FakeEngine(SpeechEngine):
+    def __init__(self, name: str):
+        self.engine_name = name
+        self.lang = "zh"
+
+    def recognize(self, file=None, lang="", deadline=None):
+        return [self.engine_name]
+
+
+def fail(health: EngineHealth, times: int):
+    for _ in range(times):
+        health.record(False, 1)
+
+
+def test_circuit_opens_after_errors():
+    health = EngineHealth("engine", alpha=1, min_calls=3, cooldown=60)
+    fail(health, 2)
+    assert health.state == EngineHealth.CLOSED
+    fail(health, 1)
+    assert health.state == EngineHealth.OPEN
+    assert not health.allow()
+
+
+def test_circuit_stays_closed_under_threshold():
+    health = EngineHealth("engine", min_calls=1, error_threshold=0.5)
+    for _ in range(20):
+        health.record(True, 1)
+        health.record(True, 1)
+        health.record(False, 1)
+    assert health.state == EngineHealth.CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    health = EngineHealth("engine", alpha=1, min_calls=1, cooldown=0.05)
+    fail(health, 1)
+    time.sleep(0.2)
+    assert health.state == EngineHealth.HALF_OPEN
+    assert health.allow()
+    assert not health.allow()
+
+
+def test_successful_probe_closes_circuit():
+    health = EngineHealth("engine", alpha=1, min_calls=1, cooldown=0.05)
+    fail(health, 1)
+    time.sleep(0.2)
+    assert health.allow()
+    health.record(True, 1)
+    assert health.state == EngineHealth.CLOSED
+    assert health.error_rate == 0
+
+
+def test_failed_probe_opens_circuit_again():
+    health = EngineHealth("engine", alpha=1, min_calls=1, cooldown=0.05)
+    fail(health, 1)
+    time.sleep(0.2)
+    assert health.allow()
+    fail(health, 1)
+    assert health.state == EngineHealth.OPEN
+
+
+def test_released_probe_can_be_retried():
+    health = EngineHealth("engine", alpha=1, min_calls=1, cooldown=0.05)
+    fail(health, 1)
+    time.sleep(0.2)
+    assert health.allow()
+    health.release()
+    assert health.allow()
+
+
+def test_score_prefers_fast_reliable_engines():
+    fast, slow, flaky = (EngineHealth(n) for n in ("fast", "slow", "flaky"))
+    fast.record(True, 1)
+    slow.record(True, 5)
+    flaky.record(True, 1)
+    fail(flaky, 3)
+    assert EngineHealth("new").score == 0
+    assert fast.score < flaky.score
+    assert fast.score < slow.score
+
+
+def test_latency_routing_orders_by_score():
+    a, b, c = FakeEngine("a"), FakeEngine("b"), FakeEngine("c")
+    dispatcher = Dispatcher(routing="latency",
+                            health={"alpha": 1, "min_calls": 2})
+    dispatcher.health_of(a).record(True, 5)
+    dispatcher.health_of(b).record(True, 1)
+    dispatcher.health_of(c).record(True, 0.1)
+    # Fast but out of service
+    fail(dispatcher.health_of(c), 1)
+    assert dispatcher.route([a, b, c]) == [b, a, c]
+    assert Dispatcher().route([a, b, c]) == [a, b, c]
+
+
+def test_error_results_open_circuit_and_engine_is_skipped():
+    engine = FakeEngine("broken")
+    dispatcher = Dispatcher(health={"alpha": 1, "min_calls": 2})
+
+    def submit(e, deadline) -> Future:
+        future = Future()
+        future.set_result(["ERROR!", "boom"])
+        return future
+
+    for _ in range(2):
+        assert list(dispatcher.dispatch([engine], submit))[0].failed
+    assert dispatcher.health_of(engine).state == EngineHealth.OPEN
+    results = list(dispatcher.dispatch([engine], submit))
+    assert len(results) == 1
+    assert isinstance(results[0].error, EngineUnavailable)
@@ -0,0 +1,28 @@
+import socket
+import urllib.request
+
+from efb_voice_recog_middleware import metrics
+
+
+def test_serves_metrics_until_closed():
+    exporter = metrics.MetricsExporter()
+    exporter.serve_http("127.0.0.1", 0)
+    port = exporter.server.server_address[1]
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as r:
+        assert b"voice_recog_engine_seconds" in r.read()
+    exporter.close()
+    assert exporter.server is None
+    with socket.socket() as s:
+        # Nothing listens on the port anymore.
+        assert s.connect_ex(("127.0.0.1", port)) != 0
+
+
+def test_port_in_use_is_not_fatal(caplog):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen()
+        exporter = metrics.MetricsExporter()
+        exporter.serve_http("127.0.0.1", s.getsockname()[1])
+    assert exporter.server is None
+    assert "Failed to serve metrics" in caplog.text
+    exporter.close()
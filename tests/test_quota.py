@@ -0,0 +1,110 @@
+import json
+import os
+import time
+
+import pytest
+
+from efb_voice_recog_middleware.deadline import Deadline
+from efb_voice_recog_middleware.quota import QuotaExceeded, QuotaStore, \
+    RateLimiter, TokenBucket
+
+
+def test_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=20, burst=2)
+    assert bucket.acquire() and bucket.acquire()
+    assert not bucket.available
+    started = time.monotonic()
+    assert bucket.acquire()
+    assert 0.02 <= time.monotonic() - started < 0.5
+
+
+def test_bucket_gives_up_before_deadline():
+    bucket = TokenBucket(rate=0.1, burst=1)
+    assert bucket.acquire()
+    assert not bucket.acquire(Deadline(0.1))
+
+
+def test_rate_limited_call_raises():
+    limiter = RateLimiter("engine", QuotaStore(),
+                          rate_limit={"rate": 0.1, "burst": 1})
+    limiter.acquire(1, Deadline(1))
+    assert not limiter.available
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire(1, Deadline(0.1))
+
+
+def test_request_quota_is_enforced():
+    limiter = RateLimiter("engine", QuotaStore(),
+                          quota={"requests_per_day": 2})
+    limiter.acquire(1)
+    limiter.acquire(1)
+    assert not limiter.available
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire(1)
+
+
+def test_seconds_quota_counts_audio_length():
+    limiter = RateLimiter("engine", QuotaStore(),
+                          quota={"seconds_per_month": 60})
+    limiter.acquire(50)
+    assert limiter.remaining("seconds_per_month") == 10
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire(20)
+    limiter.acquire(10)
+
+
+def test_headroom_is_kept_unused():
+    limiter = RateLimiter("engine", QuotaStore(),
+                          quota={"requests_per_day": 10, "headroom": 0.2})
+    for _ in range(8):
+        limiter.acquire(1)
+    assert not limiter.available
+
+
+def test_unknown_quota():
+    with pytest.raises(ValueError):
+        RateLimiter("engine", QuotaStore(), quota={"requests_per_hour": 1})
+
+
+def test_usage_is_kept_across_restarts(tmp_path):
+    path = tmp_path / "quota.json"
+    store = QuotaStore(path, save_interval=0)
+    RateLimiter("engine", store, quota={"requests_per_day": 2}).acquire(1)
+    limiter = RateLimiter("engine", QuotaStore(path),
+                          quota={"requests_per_day": 2})
+    assert limiter.remaining("requests_per_day") == 1
+
+
+def test_usage_of_past_periods_is_reset(tmp_path):
+    path = tmp_path / "quota.json"
+    path.write_text(json.dumps({"engine": {
+        "day": {"id": "2000-01-01", "requests": 5, "seconds": 50},
+        "month": {"id": "2000-01", "requests": 5, "seconds": 50},
+    }}))
+    store = QuotaStore(path)
+    assert store.get("engine", "day", "requests") == 0
+    store.add("engine", 1, 10)
+    assert store.get("engine", "month", "seconds") == 10
+
+
+def test_save_replaces_file_atomically(tmp_path):
+    path = tmp_path / "quota.json"
+    store = QuotaStore(path, save_interval=3600)
+    store.add("engine", 1, 10)
+    store.save()
+    assert json.loads(path.read_text())["engine"]["day"]["requests"] == 1
+    assert os.listdir(tmp_path) == ["quota.json"]
+
+
+def test_failed_save_keeps_previous_file(tmp_path):
+    path = tmp_path / "quota.json"
+    store = QuotaStore(path, save_interval=3600)
+    store.add("engine", 1, 10)
+    store.save()
+    # A directory where the temporary file goes makes the write fail.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.mkdir(tmp)
+    store.add("engine", 1, 10)
+    store.save()
+    assert json.loads(path.read_text())["engine"]["day"]["requests"] == 1
+    os.rmdir(tmp)
@@ -0,0 +1,166 @@
+import threading
+import time
+from typing import List
+
+import pytest
+
+from efb_voice_recog_middleware.scheduler import QueueFullError, \
+    RecognitionScheduler
+
+
+class Recorder:
+    """Jobs to submit, recording the order they run or are dropped in."""
+
+    def __init__(self):
+        self.ran: List[str] = []
+        self.dropped: List[str] = []
+        self.finished = threading.Event()
+
+    def job(self, name: str):
+        self.ran.append(name)
+
+    def on_drop(self, name: str):
+        return lambda: self.dropped.append(name)
+
+
+@pytest.fixture
+def scheduler_of():
+    schedulers: List[RecognitionScheduler] = []
+
+    def make(**kwargs) -> RecognitionScheduler:
+        kwargs.setdefault("workers", 1)
+        schedulers.append(RecognitionScheduler(**kwargs))
+        return schedulers[-1]
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.shutdown()
+
+
+def block(scheduler: RecognitionScheduler) -> threading.Event:
+    """Keep the only worker busy until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit(job, auto=False)
+    assert started.wait(5)
+    return release
+
+
+def drain(scheduler: RecognitionScheduler, recorder: Recorder):
+    """Wait until all jobs queued so far have run, with one worker."""
+    limit = time.monotonic() + 5
+    while scheduler.qsize and time.monotonic() < limit:
+        time.sleep(0.01)
+    # Runs after the job the worker may still be running.
+    scheduler.submit(recorder.finished.set, auto=False)
+    assert recorder.finished.wait(5)
+
+
+def test_drop_oldest_drops_oldest_auto_job(scheduler_of):
+    scheduler = scheduler_of(queue_size=2, overflow="drop_oldest")
+    recorder = Recorder()
+    release = block(scheduler)
+    for name in ("old", "new", "newer"):
+        scheduler.submit(recorder.job, name,
+                         on_drop=recorder.on_drop(name))
+    assert recorder.dropped == ["old"]
+    assert scheduler.qsize == 2
+    release.set()
+    drain(scheduler, recorder)
+    assert recorder.ran == ["new", "newer"]
+
+
+def test_drop_oldest_never_drops_manual_jobs(scheduler_of):
+    scheduler = scheduler_of(queue_size=2, overflow="drop_oldest")
+    recorder = Recorder()
+    release = block(scheduler)
+    scheduler.submit(recorder.job, "manual", auto=False,
+                     on_drop=recorder.on_drop("manual"))
+    scheduler.submit(recorder.job, "auto", auto=True,
+                     on_drop=recorder.on_drop("auto"))
+    scheduler.submit(recorder.job, "manual 2", auto=False,
+                     on_drop=recorder.on_drop("manual 2"))
+    assert recorder.dropped == ["auto"]
+    # Nothing older is left to drop for a new auto job.
+    scheduler.submit(recorder.job, "auto 2", auto=True,
+                     on_drop=recorder.on_drop("auto 2"))
+    assert recorder.dropped == ["auto", "auto 2"]
+    release.set()
+    drain(scheduler, recorder)
+    assert recorder.ran == ["manual", "manual 2"]
+
+
+def test_reject_raises_when_full(scheduler_of):
+    scheduler = scheduler_of(queue_size=1, overflow="reject")
+    recorder = Recorder()
+    release = block(scheduler)
+    scheduler.submit(recorder.job, "first")
+    with pytest.raises(QueueFullError):
+        scheduler.submit(recorder.job, "second")
+    release.set()
+    drain(scheduler, recorder)
+    assert recorder.ran == ["first"]
+
+
+def test_block_waits_for_a_free_slot(scheduler_of):
+    scheduler = scheduler_of(queue_size=1, overflow="block")
+    recorder = Recorder()
+    release = block(scheduler)
+    scheduler.submit(recorder.job, "first")
+    submitted = threading.Event()
+
+    def submit():
+        scheduler.submit(recorder.job, "second")
+        submitted.set()
+
+    threading.Thread(target=submit, daemon=True).start()
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(5)
+    drain(scheduler, recorder)
+    assert recorder.ran == ["first", "second"]
+
+
+def test_unknown_overflow_mode():
+    with pytest.raises(ValueError):
+        RecognitionScheduler(overflow="ignore")
+
+
+def test_manual_jobs_run_before_auto_jobs(scheduler_of):
+    scheduler, recorder = scheduler_of(), Recorder()
+    release = block(scheduler)
+    scheduler.submit(recorder.job, "auto 1", auto=True)
+    scheduler.submit(recorder.job, "auto 2", auto=True)
+    scheduler.submit(recorder.job, "manual", auto=False)
+    release.set()
+    drain(scheduler, recorder)
+    assert recorder.ran == ["manual", "auto 1", "auto 2"]
+
+
+def test_chats_are_served_round_robin(scheduler_of):
+    scheduler, recorder = scheduler_of(), Recorder()
+    release = block(scheduler)
+    for name in ("a1", "a2", "a3"):
+        scheduler.submit(recorder.job, name, chat="a")
+    scheduler.submit(recorder.job, "b1", chat="b")
+    scheduler.submit(recorder.job, "c1", chat="c")
+    release.set()
+    drain(scheduler, recorder)
+    assert recorder.ran == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_stale_auto_jobs_are_dropped(scheduler_of):
+    scheduler, recorder = scheduler_of(max_age=0.1), Recorder()
+    release = block(scheduler)
+    scheduler.submit(recorder.job, "stale", auto=True,
+                     on_drop=recorder.on_drop("stale"))
+    scheduler.submit(recorder.job, "manual", auto=False)
+    time.sleep(0.3)
+    release.set()
+    drain(scheduler, recorder)
+    assert recorder.dropped == ["stale"]
+    assert recorder.ran == ["manual"]
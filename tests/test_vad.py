@@ -0,0 +1,71 @@
+import math
+from array import array
+
+from efb_voice_recog_middleware.vad import VoiceActivityDetector
+
+RATE = 16000
+BYTES_PER_SECOND = RATE * 2
+
+
+def silence(seconds: float) -> bytes:
+    return bytes(int(RATE * seconds) * 2)
+
+
+def tone(seconds: float) -> bytes:
+    return array("h", (int(8000 * math.sin(2 * math.pi * 440 * i / RATE))
+                       for i in range(int(RATE * seconds)))).tobytes()
+
+
+def seconds(chunks):
+    return [(round(s / BYTES_PER_SECOND, 2), round(e / BYTES_PER_SECOND, 2))
+            for s, e in chunks]
+
+
+def test_silent_clip_has_no_chunks():
+    assert VoiceActivityDetector().split(silence(2)) == []
+
+
+def test_speech_without_silence_is_kept_whole():
+    pcm = tone(2)
+    assert VoiceActivityDetector().split(pcm) == [(0, len(pcm))]
+
+
+def test_silence_is_trimmed_keeping_padding():
+    pcm = silence(1) + tone(1) + silence(1)
+    [(start, end)] = seconds(
+        VoiceActivityDetector(padding=0.3, frame=0.03).split(pcm))
+    assert abs(start - 0.7) <= 0.03
+    assert abs(end - 2.3) <= 0.06
+
+
+def test_long_clip_is_split_at_pause():
+    pcm = tone(4) + silence(1) + tone(4)
+    chunks = seconds(VoiceActivityDetector(max_chunk=6).split(pcm))
+    assert len(chunks) == 2
+    (_, first_end), (second_start, _) = chunks
+    # Split within the pause, keeping padding around speech
+    assert 4 < first_end <= 4.5
+    assert 4.5 <= second_start < 5
+    assert all(e - s <= 6 for s, e in chunks)
+
+
+def test_long_clip_without_pause_is_split_at_max_chunk():
+    pcm = tone(10)
+    chunks = seconds(VoiceActivityDetector(max_chunk=4).split(pcm))
+    assert len(chunks) == 3
+    assert all(e - s <= 4 for s, e in chunks)
+    assert chunks[0][0] == 0 and chunks[-1][1] == 10
+    # Chunks are contiguous when nothing is cut out.
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+
+def test_short_pauses_are_not_split_points():
+    vad = VoiceActivityDetector(min_pause=0.5)
+    voiced = vad.voiced(tone(1) + silence(0.2) + tone(1) + silence(0.6)
+                        + tone(1))
+    assert len(vad.pauses(voiced)) == 1
+
+
+def test_max_chunk_zero_never_splits():
+    pcm = tone(20)
+    assert VoiceActivityDetector(max_chunk=0).split(pcm) == [(0, len(pcm))]